@@ -12,14 +12,33 @@ CORREÇÕES IMPLEMENTADAS:
 """
 
 import os
+import sys
+import io
+import csv
+import zlib
+import glob
 import json
+import uuid
+import random
+import time
+import queue
+import atexit
 import logging
 import sqlite3
-from datetime import datetime, timedelta
-from flask import Flask, jsonify, render_template_string, request
+import string
+import unicodedata
+from collections import OrderedDict, deque, namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from flask import Flask, Response, jsonify, render_template_string, request, stream_with_context
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 import requests
+from requests.adapters import HTTPAdapter
+import threading
 from threading import Lock
 
 # Configurar logging
@@ -33,26 +52,106 @@ app = Flask(__name__)
 
 # Lock para thread-safety
 db_lock = Lock()
+outbox_lock = Lock()
+
+class BufferLogs:
+    """Buffer circular de logs em memória
+    
+    Cada entrada recebe um número de sequência crescente ('seq'). Inserir
+    é O(1) e a entrada mais antiga sai sozinha quando a capacidade enche;
+    leitores pedem só o que chegou depois do último 'seq' que já viram.
+    """
+    
+    def __init__(self, capacidade=200):
+        self._itens = deque(maxlen=capacidade)
+        self._seq = 0
+        self._lock = Lock()
+    
+    @property
+    def ultimo_seq(self):
+        return self._seq
+    
+    def __len__(self):
+        return len(self._itens)
+    
+    def adicionar(self, entrada):
+        with self._lock:
+            self._seq += 1
+            entrada['seq'] = self._seq
+            self._itens.append(entrada)
+            return self._seq
+    
+    def recentes(self, limite=None, desde=None):
+        """Entradas mais novas primeiro; `desde` filtra as com seq > desde
+        
+        Um `desde` maior que o último seq veio de outro processo (o seq
+        recomeça a cada inicialização) e é tratado como sem cursor.
+        """
+        with self._lock:
+            quantidade = len(self._itens)
+            if desde is not None and desde <= self._seq:
+                quantidade = min(quantidade, max(self._seq - desde, 0))
+            if limite is not None:
+                quantidade = min(quantidade, limite)
+            return list(islice(reversed(self._itens), quantidade))
+
+
+class AvisoMudancas:
+    """Versão monotônica do estado do sistema que avisa quem está esperando
+    
+    Incrementada por add_log, alterações em system_state/stats e gravações
+    de mensagens. O stream SSE bloqueia em aguardar() até a versão mudar e
+    as rotas de consulta a usam como ETag (304 quando nada mudou).
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.versao = 0
+        # Distingue processos: a versão recomeça do zero a cada inicialização
+        self.instancia = uuid.uuid4().hex[:8]
+    
+    def avisar(self):
+        with self._cond:
+            self.versao += 1
+            self._cond.notify_all()
+    
+    def aguardar(self, versao_vista, timeout):
+        """Espera a versão ser diferente de `versao_vista`; retorna a versão atual"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.versao != versao_vista, timeout)
+            return self.versao
+
+
+avisos = AvisoMudancas()
+
+
+class EstadoObservado(dict):
+    """dict que incrementa a versão do estado a cada atribuição"""
+    
+    def __setitem__(self, chave, valor):
+        super().__setitem__(chave, valor)
+        avisos.avisar()
 
 # Estado global
-system_state = {
+system_state = EstadoObservado({
     'last_run': None,
     'last_status': "Aguardando primeira execução",
     'is_running': False,
     'current_step': '',
     'processed_events': set(),
-    'stats': {
+    'stats': EstadoObservado({
         'total_runs': 0,
         'successful_messages': 0,
         'failed_messages': 0,
         'last_error': None,
         'eventos_novos': 0,
         'eventos_mudanca': 0,
-        'eventos_sem_mudanca': 0
-    },
-    'logs': [],
-    'max_logs': 200
-}
+        'eventos_sem_mudanca': 0,
+        'sondagens_auth_economizadas': 0,
+        'reducao_prefiltro': None
+    }),
+    'logs': BufferLogs(capacidade=200)
+})
 
 # Token cache
 token_cache = {
@@ -61,12 +160,212 @@ token_cache = {
     'expires_at': None
 }
 
+# Layouts de headers aceitos por listar/evento, na ordem de sondagem
+ESTRATEGIAS_AUTH = {
+    1: 'Apenas user_token no Authorization',
+    2: 'Bearer token + user token separado',
+    3: 'Bearer token + token_usuario como header'
+}
+
+# Última estratégia que funcionou (persistida na tabela config)
+estrategia_auth = {
+    'preferida': None,
+    'carregada': False
+}
+
 # ==================== BANCO DE DADOS ====================
 
+# Em produção aponte DB_PATH para um disco persistente (ex.: /var/data);
+# /tmp é apagado a cada restart do container
+DB_PATH = os.getenv('DB_PATH', '/tmp/hinova_messages.db')
+
+# Backups online (API de backup do SQLite) em um volume montado
+BACKUP_DIR = os.getenv('BACKUP_DIR', '')
+BACKUP_INTERVALO_MINUTOS = int(os.getenv('BACKUP_INTERVALO_MINUTOS', '30'))
+# Pelo menos 1: o backup recém-gravado nunca entra na limpeza
+BACKUP_MANTER = max(1, int(os.getenv('BACKUP_MANTER', '5')))
+
+
+class GerenciadorConexoes:
+    """Conexões SQLite persistentes, uma por thread
+    
+    Cada thread (scheduler, workers do gunicorn) reaproveita a mesma conexão
+    em vez de abrir/fechar o arquivo a cada consulta. O cache de statements
+    do sqlite3 faz com que o mesmo SQL seja preparado apenas uma vez por
+    conexão, e o modo WAL permite leituras concorrentes com a escrita.
+    """
+    
+    def __init__(self, caminho, cached_statements=128):
+        self.caminho = caminho
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._geracao = 0
+    
+    def conexao(self):
+        """Retorna a conexão da thread atual (abre na primeira chamada)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.geracao == self._geracao:
+            return conn
+        
+        if conn is not None:
+            conn.close()
+        
+        conn = sqlite3.connect(
+            self.caminho,
+            timeout=30,
+            cached_statements=self.cached_statements
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        
+        self._local.conn = conn
+        self._local.geracao = self._geracao
+        return conn
+    
+    def reabrir(self, caminho=None):
+        """Invalida as conexões abertas; cada thread reconecta no próximo uso"""
+        if caminho:
+            self.caminho = caminho
+        self._geracao += 1
+    
+    def fechar(self):
+        """Fecha a conexão da thread atual"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+db = GerenciadorConexoes(DB_PATH)
+
+# Migrações do schema, em ordem. A versão aplicada fica em PRAGMA
+# user_version; cada migração roda em sua própria transação junto com a
+# atualização da versão, então um banco existente é atualizado no lugar.
+# Nunca altere uma migração já publicada: acrescente uma nova no fim.
+MIGRACOES = [
+    (1, 'Índices do histórico de mensagens (filtros + cursor por id)', [
+        'CREATE INDEX IF NOT EXISTS idx_messages_status_id ON messages (status, id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_protocolo_id ON messages (protocolo, id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_situacao_id ON messages (situacao_codigo, id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_placa_id ON messages (placa, id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)',
+    ]),
+    (2, 'Última situação por protocolo sem ordenar em memória', [
+        'CREATE INDEX IF NOT EXISTS idx_historico_protocolo_deteccao ON evento_historico (protocolo, data_deteccao)',
+    ]),
+    (3, 'Busca de reenvios vencidos na outbox', [
+        'CREATE INDEX IF NOT EXISTS idx_outbox_status_proxima ON outbox (status, proxima_tentativa)',
+    ]),
+]
+
+def versao_schema(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def aplicar_migracoes(conn, ate_versao=None):
+    """Aplica as migrações pendentes; retorna a versão final do schema"""
+    versao = versao_schema(conn)
+    for numero, descricao, comandos in MIGRACOES:
+        if numero <= versao or (ate_versao is not None and numero > ate_versao):
+            continue
+        
+        inicio = time.perf_counter()
+        try:
+            conn.execute('BEGIN')
+            for comando in comandos:
+                conn.execute(comando)
+            conn.execute(f'PRAGMA user_version = {numero}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Erro na migração {numero} ({descricao})")
+            raise
+        
+        versao = numero
+        logger.info(f"✓ Migração {numero} aplicada: {descricao} ({time.perf_counter() - inicio:.2f}s)")
+    
+    return versao
+
+def listar_backups():
+    """Backups em BACKUP_DIR, do mais novo para o mais antigo"""
+    if not BACKUP_DIR:
+        return []
+    return sorted(glob.glob(os.path.join(BACKUP_DIR, 'hinova_messages_*.db')), reverse=True)
+
+def fazer_backup():
+    """Copia o banco para BACKUP_DIR sem parar a aplicação
+    
+    A API de backup do SQLite lê um snapshot consistente (o WAL não
+    bloqueia os escritores). A cópia é gravada em .tmp e renomeada, então
+    um backup interrompido nunca substitui um válido. Mantém os
+    BACKUP_MANTER mais recentes. Retorna o caminho do backup ou None.
+    """
+    if not BACKUP_DIR:
+        return None
+    
+    inicio = time.perf_counter()
+    destino = os.path.join(BACKUP_DIR, f"hinova_messages_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    temporario = destino + '.tmp'
+    try:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        conn_backup = sqlite3.connect(temporario)
+        try:
+            db.conexao().backup(conn_backup)
+        finally:
+            conn_backup.close()
+        os.replace(temporario, destino)
+    except Exception as e:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        add_log('ERROR', f'❌ Erro no backup do banco: {str(e)}')
+        return None
+    
+    for antigo in listar_backups()[BACKUP_MANTER:]:
+        os.remove(antigo)
+    
+    add_log('INFO', f'💾 Backup do banco salvo em {destino} '
+                    f'({os.path.getsize(destino) // 1024} KB, {time.perf_counter() - inicio:.2f}s)')
+    return destino
+
+def restaurar_backup_no_boot():
+    """Restaura o backup mais recente se o banco não existir (ex.: disco novo)
+    
+    Backups que não passam no quick_check são pulados. Como a marca d'água
+    da busca incremental fica na tabela config, o primeiro ciclo depois da
+    restauração continua de onde parou em vez de reenviar a janela toda.
+    """
+    os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
+    if os.path.exists(DB_PATH) and os.path.getsize(DB_PATH) > 0:
+        return False
+    
+    for caminho in listar_backups():
+        try:
+            origem = sqlite3.connect(f'file:{caminho}?mode=ro', uri=True)
+            try:
+                if origem.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                    raise sqlite3.DatabaseError('quick_check falhou')
+                destino = sqlite3.connect(DB_PATH)
+                try:
+                    origem.backup(destino)
+                finally:
+                    destino.close()
+            finally:
+                origem.close()
+        except Exception as e:
+            # Só no console: add_log gravaria no banco que ainda está sendo restaurado
+            logger.warning(f'⚠️ Backup {caminho} ignorado: {str(e)}')
+            if os.path.exists(DB_PATH):
+                os.remove(DB_PATH)
+            continue
+        
+        add_log('SUCCESS', f'✓ Banco restaurado do backup {caminho}')
+        return True
+    
+    return False
+
 def init_database():
     """Inicializa banco de dados SQLite com nova tabela de histórico"""
     with db_lock:
-        conn = sqlite3.connect('/tmp/hinova_messages.db')
+        conn = db.conexao()
         c = conn.cursor()
         
         # Tabela de mensagens enviadas
@@ -111,6 +410,27 @@ def init_database():
             )
         ''')
         
+        # Outbox: notificações que falharam e aguardam reenvio
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                protocolo TEXT NOT NULL,
+                situacao_codigo INTEGER NOT NULL,
+                situacao_nome TEXT,
+                telefone TEXT,
+                mensagem TEXT,
+                nome_associado TEXT,
+                placa TEXT,
+                status TEXT NOT NULL DEFAULT 'PENDENTE',
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                proxima_tentativa TEXT,
+                ultimo_erro TEXT,
+                criado_em TEXT NOT NULL,
+                enviado_em TEXT,
+                UNIQUE(protocolo, situacao_codigo)
+            )
+        ''')
+        
         # Tabela de configuração
         c.execute('''
             CREATE TABLE IF NOT EXISTS config (
@@ -121,247 +441,629 @@ def init_database():
         ''')
         
         conn.commit()
-        conn.close()
+        
+        aplicar_migracoes(conn)
     
     logger.info("✓ Banco de dados inicializado")
 
-def verificar_situacao_ja_notificada(protocolo, situacao_codigo):
-    """Verifica se esta combinação protocolo+situação já foi notificada"""
-    with db_lock:
-        try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
-            
-            c.execute('''
-                SELECT id, data_notificacao, status_notificacao 
-                FROM evento_historico 
-                WHERE protocolo = ? AND situacao_codigo = ?
-            ''', (protocolo, situacao_codigo))
-            
-            row = c.fetchone()
-            conn.close()
-            
-            if row:
-                return True, {
-                    'id': row[0],
-                    'data_notificacao': row[1],
-                    'status': row[2]
+def carregar_historico_lote(protocolos, tamanho_lote=500):
+    """Carrega o histórico de vários protocolos em poucas consultas
+
+    Retorna dois dicionários para consulta em memória no loop de eventos:
+    - notificadas: {(protocolo, situacao_codigo): {'id', 'data_notificacao', 'status'}}
+    - ultimas: {protocolo: {'codigo', 'nome', 'data'}} (situação detectada mais recente)
+
+    Os protocolos são consultados em listas IN de até `tamanho_lote`
+    itens para respeitar o limite de parâmetros do SQLite.
+    """
+    notificadas = {}
+    ultimas = {}
+    protocolos = list(dict.fromkeys(p for p in protocolos if p is not None))
+
+    try:
+        c = db.conexao().cursor()
+
+        for inicio in range(0, len(protocolos), tamanho_lote):
+            lote = protocolos[inicio:inicio + tamanho_lote]
+            marcadores = ','.join('?' * len(lote))
+
+            c.execute(f'''
+                SELECT id, protocolo, situacao_codigo, situacao_nome, data_deteccao,
+                       data_notificacao, status_notificacao
+                FROM evento_historico
+                WHERE protocolo IN ({marcadores})
+            ''', lote)
+
+            for row in c.fetchall():
+                id_, protocolo, codigo, nome, data_deteccao, data_notificacao, status = row
+                notificadas[(protocolo, codigo)] = {
+                    'id': id_,
+                    'data_notificacao': data_notificacao,
+                    'status': status
                 }
-            return False, None
-            
-        except Exception as e:
-            logger.error(f"Erro ao verificar histórico: {e}")
-            return False, None
 
-def registrar_situacao_detectada(protocolo, situacao_codigo, situacao_nome):
-    """Registra que esta situação foi detectada (mas ainda não notificada)"""
-    with db_lock:
-        try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
-            
-            c.execute('''
-                INSERT OR IGNORE INTO evento_historico 
-                (protocolo, situacao_codigo, situacao_nome, data_deteccao)
-                VALUES (?, ?, ?, ?)
-            ''', (protocolo, situacao_codigo, situacao_nome, datetime.now().isoformat()))
-            
-            conn.commit()
-            conn.close()
+                ultima = ultimas.get(protocolo)
+                if ultima is None or data_deteccao > ultima['data']:
+                    ultimas[protocolo] = {
+                        'codigo': codigo,
+                        'nome': nome,
+                        'data': data_deteccao
+                    }
+
+    except Exception as e:
+        # Sem o histórico todos os eventos pareceriam novos e seriam reenviados,
+        # então a falha interrompe o ciclo em vez de devolver dicionários vazios
+        logger.error(f"Erro ao carregar histórico em lote: {e}")
+        raise
+
+    return notificadas, ultimas
+
+class EscritorLote:
+    """Acumula as escritas de um ciclo e grava em transações agrupadas
+
+    Único caminho de escrita do histórico e das mensagens no ciclo de
+    processar_eventos (a outbox grava os próprios reenvios). As operações
+    são gravadas com executemany a cada `max_pendentes` operações, após
+    cada leva de resultados do envio e no fim do ciclo (descarregar),
+    sempre na ordem: histórico, notificações, mensagens.
+
+    A detecção e o resultado do envio de um evento entram na mesma
+    transação, e um status só é enfileirado depois do retorno do envio,
+    então nenhum protocolo fica ENVIADO sem que a mensagem tenha saído.
+    Envios que falharam entram na outbox na mesma transação (enfileirar_reenvio).
+    """
+
+    def __init__(self, max_pendentes=50):
+        self.max_pendentes = max_pendentes
+        self._detectadas = []
+        self._notificadas = []
+        self._mensagens = []
+        self._reenvios = []
+
+    def pendentes(self):
+        return len(self._detectadas) + len(self._notificadas) + len(self._mensagens) + len(self._reenvios)
+
+    def registrar_situacao(self, protocolo, situacao_codigo, situacao_nome):
+        self._detectadas.append((protocolo, situacao_codigo, situacao_nome, datetime.now().isoformat()))
+
+    def marcar_notificada(self, protocolo, situacao_codigo, status='ENVIADO'):
+        self._notificadas.append((datetime.now().isoformat(), status, protocolo, situacao_codigo))
+        self._verificar_limite()
+
+    def salvar_mensagem(self, protocolo, evento_id, situacao_codigo, situacao_nome,
+                        telefone, mensagem, status, erro=None, nome_associado=None, placa=None):
+        self._mensagens.append((
+            datetime.now().isoformat(), protocolo, evento_id, situacao_codigo, situacao_nome,
+            telefone, mensagem, status, erro, nome_associado, placa
+        ))
+        self._verificar_limite()
+
+    def enfileirar_reenvio(self, protocolo, situacao_codigo, situacao_nome, telefone,
+                           mensagem, nome_associado=None, placa=None, atraso_segundos=60):
+        agora = datetime.now()
+        self._reenvios.append((
+            protocolo, situacao_codigo, situacao_nome, telefone, mensagem, nome_associado, placa,
+            (agora + timedelta(seconds=atraso_segundos)).isoformat(), agora.isoformat()
+        ))
+        self._verificar_limite()
+
+    def _verificar_limite(self):
+        if self.pendentes() >= self.max_pendentes:
+            self.descarregar()
+
+    def descarregar(self):
+        """Grava tudo que está pendente em uma única transação"""
+        if not self.pendentes():
             return True
-            
-        except Exception as e:
-            logger.error(f"Erro ao registrar situação: {e}")
-            return False
 
-def marcar_situacao_como_notificada(protocolo, situacao_codigo, status='ENVIADO'):
-    """Marca que a notificação foi enviada para esta situação"""
+        with db_lock:
+            try:
+                with db.conexao() as conn:
+                    conn.executemany('''
+                        INSERT OR IGNORE INTO evento_historico
+                        (protocolo, situacao_codigo, situacao_nome, data_deteccao)
+                        VALUES (?, ?, ?, ?)
+                    ''', self._detectadas)
+
+                    conn.executemany('''
+                        UPDATE evento_historico
+                        SET data_notificacao = ?, status_notificacao = ?
+                        WHERE protocolo = ? AND situacao_codigo = ?
+                    ''', self._notificadas)
+
+                    conn.executemany('''
+                        INSERT INTO messages
+                        (timestamp, protocolo, evento_id, situacao_codigo, situacao_nome,
+                         telefone, mensagem, status, erro, nome_associado, placa)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', self._mensagens)
+
+                    conn.executemany('''
+                        INSERT OR IGNORE INTO outbox
+                        (protocolo, situacao_codigo, situacao_nome, telefone, mensagem,
+                         nome_associado, placa, proxima_tentativa, criado_em)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', self._reenvios)
+
+                self._detectadas.clear()
+                self._notificadas.clear()
+                self._mensagens.clear()
+                self._reenvios.clear()
+                avisos.avisar()
+                return True
+
+            except Exception as e:
+                # Mantém os itens pendentes para a próxima tentativa
+                logger.error(f"Erro ao gravar lote de escritas: {e}")
+                return False
+
+    def descarregar_com_tentativas(self, tentativas=3, espera=0.5):
+        """Tenta gravar o pendente algumas vezes antes de desistir"""
+        for tentativa in range(tentativas):
+            if self.descarregar():
+                return True
+            if tentativa < tentativas - 1:
+                time.sleep(espera * (2 ** tentativa))
+        return False
+
+def buscar_reenvios_pendentes(limite=50):
+    """Itens da outbox com reenvio vencido, mais antigos primeiro"""
+    try:
+        c = db.conexao().cursor()
+        
+        c.execute('''
+            SELECT * FROM outbox
+            WHERE status = 'PENDENTE' AND proxima_tentativa <= ?
+            ORDER BY proxima_tentativa
+            LIMIT ?
+        ''', (datetime.now().isoformat(), limite))
+        
+        columns = [description[0] for description in c.description]
+        return [dict(zip(columns, row)) for row in c.fetchall()]
+    except Exception as e:
+        logger.error(f"Erro ao buscar reenvios pendentes: {e}")
+        return []
+
+def reservar_reenvio(item, segundos):
+    """Empurra proxima_tentativa do item antes do envio
+    
+    Se o resultado do envio não puder ser gravado (ou o processo cair no
+    meio), o item só volta a vencer daqui a `segundos`, em vez de ser
+    reenviado na próxima rodada da outbox. Retorna False se não gravou.
+    """
+    proxima = (datetime.now() + timedelta(seconds=segundos)).isoformat()
     with db_lock:
         try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
-            
-            c.execute('''
-                UPDATE evento_historico 
-                SET data_notificacao = ?, status_notificacao = ?
-                WHERE protocolo = ? AND situacao_codigo = ?
-            ''', (datetime.now().isoformat(), status, protocolo, situacao_codigo))
-            
-            conn.commit()
-            conn.close()
+            with db.conexao() as conn:
+                conn.execute('''
+                    UPDATE outbox SET proxima_tentativa = ?
+                    WHERE id = ? AND status = 'PENDENTE'
+                ''', (proxima, item['id']))
             return True
-            
         except Exception as e:
-            logger.error(f"Erro ao marcar notificação: {e}")
+            logger.error(f"Erro ao reservar reenvio: {e}")
             return False
 
-def get_ultima_situacao(protocolo):
-    """Retorna a última situação conhecida de um protocolo"""
+def registrar_tentativa_reenvio(item, enviado, max_tentativas=5, intervalo_base=60, intervalo_maximo=3600):
+    """Grava o resultado de um reenvio da outbox
+    
+    Sucesso: outbox e evento_historico passam a ENVIADO e a mensagem vai
+    para o histórico. Falha: a próxima tentativa é agendada com backoff
+    exponencial (intervalo_base * 2^tentativas, até intervalo_maximo) mais
+    jitter de até 50%; ao atingir max_tentativas o item vai para MORTO.
+    """
+    agora = datetime.now()
+    tentativas = item['tentativas'] + 1
+    
     with db_lock:
         try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
-            
-            c.execute('''
-                SELECT situacao_codigo, situacao_nome, data_deteccao 
-                FROM evento_historico 
-                WHERE protocolo = ?
-                ORDER BY data_deteccao DESC
-                LIMIT 1
-            ''', (protocolo,))
-            
-            row = c.fetchone()
-            conn.close()
-            
-            if row:
-                return {
-                    'codigo': row[0],
-                    'nome': row[1],
-                    'data': row[2]
-                }
-            return None
-            
+            with db.conexao() as conn:
+                if enviado:
+                    conn.execute('''
+                        UPDATE outbox SET status = 'ENVIADO', tentativas = ?, enviado_em = ?, ultimo_erro = NULL
+                        WHERE id = ?
+                    ''', (tentativas, agora.isoformat(), item['id']))
+                    conn.execute('''
+                        UPDATE evento_historico
+                        SET data_notificacao = ?, status_notificacao = 'ENVIADO'
+                        WHERE protocolo = ? AND situacao_codigo = ?
+                    ''', (agora.isoformat(), item['protocolo'], item['situacao_codigo']))
+                    conn.execute('''
+                        INSERT INTO messages
+                        (timestamp, protocolo, evento_id, situacao_codigo, situacao_nome,
+                         telefone, mensagem, status, erro, nome_associado, placa)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, 'ENVIADO', ?, ?, ?)
+                    ''', (
+                        agora.isoformat(), item['protocolo'], f"{item['protocolo']}_{item['situacao_codigo']}",
+                        item['situacao_codigo'], item['situacao_nome'], item['telefone'], item['mensagem'],
+                        f'Reenvio (tentativa {tentativas})', item['nome_associado'], item['placa']
+                    ))
+                    resultado = 'ENVIADO'
+                
+                elif tentativas >= max_tentativas:
+                    conn.execute('''
+                        UPDATE outbox SET status = 'MORTO', tentativas = ?, ultimo_erro = ?
+                        WHERE id = ?
+                    ''', (tentativas, 'Erro no envio', item['id']))
+                    resultado = 'MORTO'
+                
+                else:
+                    atraso = min(intervalo_base * 2 ** tentativas, intervalo_maximo)
+                    atraso += random.uniform(0, atraso * 0.5)
+                    conn.execute('''
+                        UPDATE outbox SET tentativas = ?, proxima_tentativa = ?, ultimo_erro = ?
+                        WHERE id = ?
+                    ''', (tentativas, (agora + timedelta(seconds=atraso)).isoformat(), 'Erro no envio', item['id']))
+                    resultado = 'PENDENTE'
+            
+            # Contagens da outbox mudaram: invalida o ETag/estado do dashboard
+            avisos.avisar()
+            return resultado
         except Exception as e:
-            logger.error(f"Erro ao buscar última situação: {e}")
+            logger.error(f"Erro ao registrar reenvio: {e}")
             return None
 
-def save_message_log(protocolo, evento_id, situacao_codigo, situacao_nome, 
-                     telefone, mensagem, status, erro=None, nome_associado=None, placa=None):
-    """Salva log de mensagem no banco"""
-    with db_lock:
-        try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
-            
-            c.execute('''
-                INSERT INTO messages 
-                (timestamp, protocolo, evento_id, situacao_codigo, situacao_nome, 
-                 telefone, mensagem, status, erro, nome_associado, placa)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                datetime.now().isoformat(),
-                protocolo,
-                evento_id,
-                situacao_codigo,
-                situacao_nome,
-                telefone,
-                mensagem,
-                status,
-                erro,
-                nome_associado,
-                placa
-            ))
-            
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            logger.error(f"Erro ao salvar log de mensagem: {e}")
+def estatisticas_outbox():
+    """Backlog e latência dos reenvios para o dashboard"""
+    try:
+        c = db.conexao().cursor()
+        
+        c.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+        contagem = dict(c.fetchall())
+        
+        c.execute("SELECT MIN(criado_em) FROM outbox WHERE status = 'PENDENTE'")
+        mais_antigo = c.fetchone()[0]
+        
+        c.execute('''
+            SELECT AVG((julianday(enviado_em) - julianday(criado_em)) * 86400)
+            FROM outbox WHERE status = 'ENVIADO'
+        ''')
+        latencia = c.fetchone()[0]
+        
+        return {
+            'pendentes': contagem.get('PENDENTE', 0),
+            'reenviados': contagem.get('ENVIADO', 0),
+            'mortos': contagem.get('MORTO', 0),
+            # Horário (com fuso) e não a idade: o corpo só muda junto com a versão do ETag
+            'pendente_mais_antigo_em': datetime.fromisoformat(mais_antigo).astimezone().isoformat() if mais_antigo else None,
+            'latencia_media_reenvio_s': round(latencia, 1) if latencia is not None else None
+        }
+    except Exception as e:
+        logger.error(f"Erro ao calcular estatísticas da outbox: {e}")
+        return {}
 
-def save_system_log(level, message):
-    """Salva log do sistema no banco"""
-    with db_lock:
+class GravadorLogs:
+    """Grava os logs do sistema em segundo plano, em lotes
+    
+    add_log apenas enfileira a linha; uma thread daemon consome a fila,
+    insere os lotes com executemany e aplica a retenção de system_logs
+    a cada `intervalo_retencao` segundos em vez de a cada escrita.
+    
+    Com a fila cheia, a política 'descartar' ignora a linha nova e a
+    política 'bloquear' espera até `espera_maxima` segundos por espaço
+    (e descarta se o tempo acabar). Os descartes ficam nos contadores.
+    """
+    
+    def __init__(self, capacidade=5000, tamanho_lote=200, politica='descartar',
+                 espera_maxima=2.0, max_logs_banco=1000, intervalo_retencao=60):
+        self.fila = queue.Queue(maxsize=capacidade)
+        self.tamanho_lote = tamanho_lote
+        self.politica = politica
+        self.espera_maxima = espera_maxima
+        self.max_logs_banco = max_logs_banco
+        self.intervalo_retencao = intervalo_retencao
+        self.contadores = {
+            'enfileirados': 0,
+            'gravados': 0,
+            'descartados': 0,
+            'erros_gravacao': 0
+        }
+        self._thread = None
+        self._parar = threading.Event()
+        self._lock = Lock()
+        self._ultima_retencao = 0.0
+    
+    def registrar(self, level, message):
+        """Enfileira uma linha de log (não bloqueia com a política 'descartar')"""
+        self._garantir_thread()
+        item = (datetime.now().isoformat(), level, message)
+        
         try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
+            if self.politica == 'bloquear':
+                self.fila.put(item, timeout=self.espera_maxima)
+            else:
+                self.fila.put_nowait(item)
+            self._contar(enfileirados=1)
+        except queue.Full:
+            self._contar(descartados=1)
+    
+    def _contar(self, **incrementos):
+        # Chamado de várias threads (requisições, envio, busca, gravador): += em dict não é atômico
+        with self._lock:
+            for chave, valor in incrementos.items():
+                self.contadores[chave] += valor
+    
+    def estatisticas(self):
+        with self._lock:
+            contadores = dict(self.contadores)
+        return dict(contadores, fila=self.fila.qsize(), politica=self.politica)
+    
+    def _garantir_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._parar.clear()
+                self._thread = threading.Thread(target=self._executar, name='gravador-logs', daemon=True)
+                self._thread.start()
+    
+    def _executar(self):
+        while not self._parar.is_set() or not self.fila.empty():
+            try:
+                lote = [self.fila.get(timeout=1)]
+            except queue.Empty:
+                lote = []
             
-            c.execute('''
-                INSERT INTO system_logs (timestamp, level, message)
-                VALUES (?, ?, ?)
-            ''', (datetime.now().isoformat(), level, message))
+            while lote and len(lote) < self.tamanho_lote:
+                try:
+                    lote.append(self.fila.get_nowait())
+                except queue.Empty:
+                    break
             
-            # Manter apenas últimos 1000 logs
-            c.execute('''
-                DELETE FROM system_logs 
-                WHERE id NOT IN (
-                    SELECT id FROM system_logs 
-                    ORDER BY id DESC LIMIT 1000
-                )
-            ''')
+            if lote:
+                self._gravar(lote)
             
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            logger.error(f"Erro ao salvar log do sistema: {e}")
+            if time.monotonic() - self._ultima_retencao >= self.intervalo_retencao:
+                self._aplicar_retencao()
+    
+    def _gravar(self, lote):
+        with db_lock:
+            try:
+                with db.conexao() as conn:
+                    conn.executemany('''
+                        INSERT INTO system_logs (timestamp, level, message)
+                        VALUES (?, ?, ?)
+                    ''', lote)
+                self._contar(gravados=len(lote))
+                avisos.avisar()
+            except Exception as e:
+                self._contar(erros_gravacao=1, descartados=len(lote))
+                logger.error(f"Erro ao salvar log do sistema: {e}")
+    
+    def _aplicar_retencao(self):
+        """Mantém apenas os últimos `max_logs_banco` logs"""
+        self._ultima_retencao = time.monotonic()
+        with db_lock:
+            try:
+                with db.conexao() as conn:
+                    conn.execute('''
+                        DELETE FROM system_logs
+                        WHERE id <= (
+                            SELECT id FROM system_logs
+                            ORDER BY id DESC LIMIT 1 OFFSET ?
+                        )
+                    ''', (self.max_logs_banco,))
+            except Exception as e:
+                logger.error(f"Erro ao aplicar retenção de logs: {e}")
+    
+    def parar(self, timeout=5):
+        """Grava o que restou na fila e encerra a thread"""
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
 
-def get_messages_history(limit=100):
-    """Recupera histórico de mensagens"""
-    with db_lock:
+
+gravador_logs = GravadorLogs(
+    capacidade=int(os.getenv('LOG_FILA_CAPACIDADE', '5000')),
+    politica=os.getenv('LOG_FILA_POLITICA', 'descartar')
+)
+atexit.register(gravador_logs.parar)
+
+def save_system_log(level, message):
+    """Salva log do sistema no banco (assíncrono, via gravador_logs)"""
+    gravador_logs.registrar(level, message)
+
+# Filtros aceitos pelo histórico de mensagens (parâmetro -> coluna)
+FILTROS_MENSAGENS = ('status', 'protocolo', 'situacao_codigo', 'placa')
+LIMITE_MAXIMO_MENSAGENS = 500
+
+def ler_filtros_mensagens(args):
+    """Extrai os filtros do histórico de mensagens dos parâmetros da requisição
+    
+    As datas são normalizadas para YYYY-MM-DD ou datetime ISO, o formato
+    gravado nas colunas. Levanta ValueError (mensagem para o cliente) com
+    situacao_codigo não inteiro ou data inválida, em vez de ignorar o filtro.
+    """
+    filtros = {campo: args.get(campo) for campo in FILTROS_MENSAGENS if args.get(campo)}
+    if 'situacao_codigo' in filtros:
         try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
-            
-            c.execute('''
-                SELECT * FROM messages 
-                ORDER BY id DESC LIMIT ?
-            ''', (limit,))
-            
-            columns = [description[0] for description in c.description]
-            rows = c.fetchall()
-            
-            conn.close()
-            
-            return [dict(zip(columns, row)) for row in rows]
-        except Exception as e:
-            logger.error(f"Erro ao recuperar histórico: {e}")
-            return []
+            filtros['situacao_codigo'] = int(filtros['situacao_codigo'])
+        except ValueError:
+            raise ValueError('situacao_codigo inválido (use um número inteiro)')
+    for campo in ('data_inicio', 'data_fim'):
+        valor = args.get(campo)
+        if not valor:
+            continue
+        try:
+            if len(valor) == 10:
+                filtros[campo] = datetime.strptime(valor, '%Y-%m-%d').strftime('%Y-%m-%d')
+            else:
+                filtros[campo] = datetime.fromisoformat(valor).isoformat()
+        except ValueError:
+            raise ValueError(f'{campo} inválida (use YYYY-MM-DD ou YYYY-MM-DDTHH:MM:SS)')
+    return filtros
+
+def montar_filtro_mensagens(filtros, colunas=None, coluna_data='timestamp'):
+    """Cláusula WHERE e parâmetros para os filtros do histórico
+    
+    data_inicio/data_fim aceitam data (YYYY-MM-DD, fim inclusivo) ou
+    datetime ISO, comparados com a coluna de data ISO gravada. `colunas`
+    mapeia filtro -> coluna para outras tabelas; filtros fora dele são
+    ignorados.
+    """
+    if colunas is None:
+        colunas = {campo: campo for campo in FILTROS_MENSAGENS}
+    condicoes, parametros = [], []
+    for campo, coluna in colunas.items():
+        if filtros.get(campo) is not None:
+            condicoes.append(f'{coluna} = ?')
+            parametros.append(filtros[campo])
+    
+    if filtros.get('data_inicio'):
+        condicoes.append(f'{coluna_data} >= ?')
+        parametros.append(filtros['data_inicio'])
+    if filtros.get('data_fim'):
+        data_fim = filtros['data_fim']
+        if len(data_fim) == 10:
+            data_fim = (datetime.strptime(data_fim, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+            condicoes.append(f'{coluna_data} < ?')
+        else:
+            condicoes.append(f'{coluna_data} <= ?')
+        parametros.append(data_fim)
+    
+    return condicoes, parametros
+
+def get_messages_history(limit=100, before_id=None, after_id=None, filtros=None):
+    """Recupera histórico de mensagens, mais novas primeiro
+    
+    Paginação por cursor: before_id traz as mensagens mais antigas que esse
+    id (próxima página), after_id as mais novas (atualização do topo).
+    """
+    limit = max(1, min(limit, LIMITE_MAXIMO_MENSAGENS))
+    condicoes, parametros = montar_filtro_mensagens(filtros or {})
+    ordem = 'DESC'
+    if before_id is not None:
+        condicoes.append('id < ?')
+        parametros.append(before_id)
+    if after_id is not None:
+        condicoes.append('id > ?')
+        parametros.append(after_id)
+        # Pega as mais próximas do cursor e devolve na ordem usual
+        ordem = 'ASC'
+    
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    try:
+        c = db.conexao().cursor()
+        
+        c.execute(f'''
+            SELECT * FROM messages {where}
+            ORDER BY id {ordem} LIMIT ?
+        ''', (*parametros, limit))
+        
+        columns = [description[0] for description in c.description]
+        rows = c.fetchall()
+        if ordem == 'ASC':
+            rows.reverse()
+        
+        return [dict(zip(columns, row)) for row in rows]
+    except Exception as e:
+        logger.error(f"Erro ao recuperar histórico: {e}")
+        return []
+
+# Tabelas exportáveis: filtro -> coluna e coluna de data usada no intervalo
+EXPORTACOES = {
+    'messages': {
+        'colunas': {campo: campo for campo in FILTROS_MENSAGENS},
+        'coluna_data': 'timestamp'
+    },
+    'evento_historico': {
+        'colunas': {'status': 'status_notificacao', 'protocolo': 'protocolo', 'situacao_codigo': 'situacao_codigo'},
+        'coluna_data': 'data_deteccao'
+    }
+}
+
+def exportar_tabela(tabela, filtros, formato='csv', tamanho_bloco=1000):
+    """Gera a exportação de `tabela` em blocos de texto (CSV ou NDJSON)
+    
+    Percorre o cursor com fetchmany, então a memória fica constante
+    qualquer que seja o tamanho da tabela. Ordem por id crescente.
+    """
+    definicao = EXPORTACOES[tabela]
+    condicoes, parametros = montar_filtro_mensagens(filtros, definicao['colunas'], definicao['coluna_data'])
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    
+    cursor = db.conexao().cursor()
+    try:
+        cursor.execute(f'SELECT * FROM {tabela} {where} ORDER BY id', parametros)
+        colunas = [description[0] for description in cursor.description]
+        
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        if formato == 'csv':
+            escritor.writerow(colunas)
+        
+        while True:
+            linhas = cursor.fetchmany(tamanho_bloco)
+            if not linhas:
+                break
+            if formato == 'csv':
+                escritor.writerows(linhas)
+            else:
+                for linha in linhas:
+                    buffer.write(json.dumps(dict(zip(colunas, linha)), ensure_ascii=False))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        cursor.close()
+
+def comprimir_gzip(blocos):
+    """Comprime um gerador de blocos de texto em gzip sem juntar tudo na memória"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for bloco in blocos:
+        dados = compressor.compress(bloco.encode('utf-8'))
+        if dados:
+            yield dados
+    yield compressor.flush()
 
 def get_system_logs(limit=100):
     """Recupera logs do sistema"""
-    with db_lock:
-        try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
-            
-            c.execute('''
-                SELECT * FROM system_logs 
-                ORDER BY id DESC LIMIT ?
-            ''', (limit,))
-            
-            columns = [description[0] for description in c.description]
-            rows = c.fetchall()
-            
-            conn.close()
-            
-            return [dict(zip(columns, row)) for row in rows]
-        except Exception as e:
-            logger.error(f"Erro ao recuperar logs: {e}")
-            return []
+    try:
+        c = db.conexao().cursor()
+        
+        c.execute('''
+            SELECT * FROM system_logs 
+            ORDER BY id DESC LIMIT ?
+        ''', (limit,))
+        
+        columns = [description[0] for description in c.description]
+        rows = c.fetchall()
+        
+        return [dict(zip(columns, row)) for row in rows]
+    except Exception as e:
+        logger.error(f"Erro ao recuperar logs: {e}")
+        return []
 
 def save_config(key, value):
     """Salva configuração no banco"""
     with db_lock:
         try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
-            
-            c.execute('''
-                INSERT OR REPLACE INTO config (key, value, updated_at)
-                VALUES (?, ?, ?)
-            ''', (key, json.dumps(value), datetime.now().isoformat()))
-            
-            conn.commit()
-            conn.close()
+            with db.conexao() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO config (key, value, updated_at)
+                    VALUES (?, ?, ?)
+                ''', (key, json.dumps(value), datetime.now().isoformat()))
         except Exception as e:
             logger.error(f"Erro ao salvar configuração: {e}")
 
 def get_config(key, default=None):
     """Recupera configuração do banco"""
-    with db_lock:
-        try:
-            conn = sqlite3.connect('/tmp/hinova_messages.db')
-            c = conn.cursor()
-            
-            c.execute('SELECT value FROM config WHERE key = ?', (key,))
-            row = c.fetchone()
-            
-            conn.close()
-            
-            if row:
-                return json.loads(row[0])
-            return default
-        except Exception as e:
-            logger.error(f"Erro ao recuperar configuração: {e}")
-            return default
+    try:
+        c = db.conexao().cursor()
+        
+        c.execute('SELECT value FROM config WHERE key = ?', (key,))
+        row = c.fetchone()
+        
+        if row:
+            return json.loads(row[0])
+        return default
+    except Exception as e:
+        logger.error(f"Erro ao recuperar configuração: {e}")
+        return default
 
 # ==================== LOG HELPER ====================
 
@@ -375,11 +1077,9 @@ def add_log(level, message):
         'message': message
     }
     
-    system_state['logs'].insert(0, log_entry)
-    
-    # Limitar logs em memória
-    if len(system_state['logs']) > system_state['max_logs']:
-        system_state['logs'] = system_state['logs'][:system_state['max_logs']]
+    # Buffer circular: as entradas mais antigas saem sozinhas
+    system_state['logs'].adicionar(log_entry)
+    avisos.avisar()
     
     # Salvar no banco
     save_system_log(level, message)
@@ -394,14 +1094,122 @@ def add_log(level, message):
 
 # ==================== APIS ====================
 
+# Pool de conexões HTTP: hosts distintos mantidos e conexões keep-alive por host.
+# Com HTTP_POOL_BLOQUEAR=true o tamanho por host também limita as conexões simultâneas.
+HTTP_POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', '4'))
+HTTP_POOL_POR_HOST = int(os.getenv('HTTP_POOL_POR_HOST', '10'))
+HTTP_POOL_BLOQUEAR = os.getenv('HTTP_POOL_BLOQUEAR', 'false').lower() == 'true'
+
+_sessoes_http = {}
+_sessoes_lock = Lock()
+
+def criar_sessao_http(pool_hosts=None, pool_por_host=None, bloquear=None):
+    """Cria uma sessão requests com keep-alive e pool de conexões"""
+    adaptador = HTTPAdapter(
+        pool_connections=pool_hosts or HTTP_POOL_HOSTS,
+        pool_maxsize=pool_por_host or HTTP_POOL_POR_HOST,
+        pool_block=HTTP_POOL_BLOQUEAR if bloquear is None else bloquear
+    )
+    sessao = requests.Session()
+    sessao.mount('https://', adaptador)
+    sessao.mount('http://', adaptador)
+    sessao.headers['Connection'] = 'keep-alive'
+    return sessao
+
+def obter_sessao_http(nome):
+    """Sessão compartilhada por nome, reaproveitada entre ciclos"""
+    with _sessoes_lock:
+        if nome not in _sessoes_http:
+            _sessoes_http[nome] = criar_sessao_http()
+        return _sessoes_http[nome]
+
+
+def limpar_telefone(*telefones):
+    """Primeiro telefone com pelo menos 10 dígitos, só com os dígitos"""
+    for telefone in telefones:
+        if telefone:
+            digitos = ''.join(filter(str.isdigit, str(telefone)))
+            if len(digitos) >= 10:
+                return digitos
+    return None
+
+
+def _internar(valor):
+    return sys.intern(valor) if type(valor) is str else valor
+
+
+class EventoHinova:
+    """Evento de listar/evento só com os campos usados pelo processamento
+    
+    O JSON da API traz o associado completo (CPF, CNH, endereço) e o
+    veículo com regional, cooperativa e voluntário. O registro é montado
+    ao ler cada resposta e os dicts crus são descartados em seguida, em
+    vez de ficarem vivos durante todo o ciclo. Campos que se repetem
+    entre eventos (situação, datas, motivo) são internados e
+    compartilhados.
+    """
+    
+    __slots__ = ('codigo', 'protocolo', 'situacao_evento', 'data_evento', 'data_cadastro', 'hora_cadastro',
+                 'motivo', 'nome_associado', 'placa', 'telefone', 'codigo_veiculo')
+    
+    def __init__(self, codigo=None, protocolo=None, situacao_evento='', data_evento=None, data_cadastro=None,
+                 hora_cadastro=None, motivo='N/A', nome_associado=None, placa=None, telefone=None,
+                 codigo_veiculo=None):
+        self.codigo = codigo
+        self.protocolo = protocolo
+        self.situacao_evento = situacao_evento
+        self.data_evento = data_evento
+        self.data_cadastro = data_cadastro
+        self.hora_cadastro = hora_cadastro
+        self.motivo = motivo
+        self.nome_associado = nome_associado
+        self.placa = placa
+        self.telefone = telefone
+        self.codigo_veiculo = codigo_veiculo
+    
+    @classmethod
+    def da_api(cls, evento):
+        """Monta o registro a partir de um evento cru da API"""
+        associado = evento.get('associado')
+        if not isinstance(associado, dict):
+            associado = {}
+        veiculo = evento.get('veiculo')
+        
+        # Motivo: string na API real, dict em versões antigas
+        motivo = evento.get('motivo', 'N/A')
+        if isinstance(motivo, dict):
+            motivo = motivo.get('nome', 'N/A')
+        
+        return cls(
+            codigo=evento.get('codigo'),
+            protocolo=evento.get('protocolo'),
+            situacao_evento=_internar(evento.get('situacao_evento', '')),
+            data_evento=_internar(evento.get('data_evento')),
+            data_cadastro=_internar(evento.get('data_cadastro')),
+            hora_cadastro=evento.get('hora_cadastro'),
+            motivo=_internar(motivo),
+            nome_associado=associado.get('nome'),
+            placa=veiculo.get('placa') if isinstance(veiculo, dict) else None,
+            telefone=limpar_telefone(associado.get('telefone_celular'), associado.get('telefone'),
+                                     associado.get('telefone_comercial')),
+            codigo_veiculo=veiculo.get('codigo') if isinstance(veiculo, dict) else evento.get('codigo_veiculo')
+        )
+    
+    def __repr__(self):
+        return f'EventoHinova(codigo={self.codigo!r}, protocolo={self.protocolo!r}, situacao_evento={self.situacao_evento!r})'
+
+
 class HinovaAPI:
     """Cliente para API Hinova SGA com auto-refresh de token"""
     
-    def __init__(self, token, usuario, senha):
+    def __init__(self, token, usuario, senha, sessao=None):
         self.token = token
         self.usuario = usuario
         self.senha = senha
         self.base_url = "https://api.hinova.com.br/api/sga/v2"
+        self.sessao = sessao or obter_sessao_http('hinova')
+        self.ultima_listagem_completa = False
+        self._auth_lock = Lock()
     
     def autenticar(self, force=False):
         """Autentica na API com cache de token"""
@@ -427,7 +1235,7 @@ class HinovaAPI:
             add_log('INFO', f'   Usuário: {self.usuario}')
             add_log('INFO', f'   URL: {url}')
             
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = self.sessao.post(url, json=payload, headers=headers, timeout=30)
             
             add_log('INFO', f'   Status HTTP: {response.status_code}')
             
@@ -466,137 +1274,248 @@ class HinovaAPI:
             add_log('ERROR', f'❌ Erro na autenticação: {str(e)}')
             return False
     
-    def listar_eventos(self, data_inicio, data_fim):
-        """Lista eventos por período"""
-        try:
-            add_log('INFO', f'📋 Buscando eventos de {data_inicio} até {data_fim}...')
-            
-            url = f"{self.base_url}/listar/evento"
-            
-            # Converter data de YYYY-MM-DD para DD/MM/YYYY (formato que a API espera)
-            from datetime import datetime as dt
-            data_inicio_br = dt.strptime(data_inicio, '%Y-%m-%d').strftime('%d/%m/%Y')
-            data_fim_br = dt.strptime(data_fim, '%Y-%m-%d').strftime('%d/%m/%Y')
-            
-            # A API Hinova usa campos diferentes!
-            payload = {
-                "data_cadastro": data_inicio_br,
-                "data_cadastro_final": data_fim_br
-            }
-            
-            # TESTE SIMPLIFICADO: Apenas user token no Authorization
-            add_log('INFO', f'   🧪 TESTE 1: Apenas user_token no Authorization')
-            headers1 = {
+    def _headers_listagem(self, estrategia):
+        """Headers de cada layout de autenticação aceito em listar/evento"""
+        if estrategia == 1:
+            return {
                 "Authorization": f"Bearer {token_cache['user_token']}",
                 "Content-Type": "application/json"
             }
-            
-            response = requests.post(url, json=payload, headers=headers1, timeout=30)
-            add_log('INFO', f'   Status: {response.status_code}')
-            
-            if response.status_code == 200:
-                add_log('SUCCESS', '✓ FUNCIONOU com apenas user_token!')
-                data = response.json()
-                
-                # A API pode retornar lista direta ou objeto com 'eventos'
-                if isinstance(data, list):
-                    eventos = data
-                    add_log('INFO', f'   Formato: Lista direta')
-                elif isinstance(data, dict):
-                    eventos = data.get('eventos', [])
-                    add_log('INFO', f'   Formato: Objeto com chave "eventos"')
-                else:
-                    add_log('ERROR', f'   Formato inesperado: {type(data)}')
-                    eventos = []
-                
-                add_log('INFO', f'✓ {len(eventos)} eventos encontrados no período')
-                return eventos
-            
-            # TESTE 2: Bearer + token separado
-            add_log('INFO', f'   🧪 TESTE 2: Bearer token + user token separado')
-            headers2 = {
+        if estrategia == 2:
+            return {
                 "Authorization": f"Bearer {token_cache['bearer_token']}",
                 "token": token_cache['user_token'],
                 "Content-Type": "application/json"
             }
-            
-            response = requests.post(url, json=payload, headers=headers2, timeout=30)
-            add_log('INFO', f'   Status: {response.status_code}')
+        return {
+            "Authorization": f"Bearer {token_cache['bearer_token']}",
+            "token_usuario": token_cache['user_token'],
+            "Content-Type": "application/json"
+        }
+    
+    def _estrategia_preferida(self):
+        """Última estratégia que funcionou (carregada do banco uma vez)"""
+        if not estrategia_auth['carregada']:
+            estrategia_auth['preferida'] = get_config('hinova_estrategia_auth')
+            estrategia_auth['carregada'] = True
+        return estrategia_auth['preferida']
+    
+    def _lembrar_estrategia(self, estrategia):
+        if estrategia != estrategia_auth['preferida']:
+            estrategia_auth['preferida'] = estrategia
+            save_config('hinova_estrategia_auth', estrategia)
+            add_log('INFO', f'   💾 Estratégia {estrategia} salva para os próximos ciclos')
+    
+    def _post_listagem(self, url, payload):
+        """POST em listar/evento usando a estratégia de headers aprendida
+        
+        Tenta primeiro a estratégia que funcionou por último; só sonda as
+        demais (na ordem de ESTRATEGIAS_AUTH) se ela for recusada com 401/403
+        ou se ainda não houver nenhuma salva. Retorna a última resposta.
+        """
+        preferida = self._estrategia_preferida()
+        recusada = None
+        
+        if preferida in ESTRATEGIAS_AUTH:
+            response = self.sessao.post(url, json=payload, headers=self._headers_listagem(preferida), timeout=30)
             
             if response.status_code == 200:
-                add_log('SUCCESS', '✓ FUNCIONOU com Bearer + token separado!')
-                data = response.json()
-                
-                # A API pode retornar lista direta ou objeto com 'eventos'
-                if isinstance(data, list):
-                    eventos = data
-                    add_log('INFO', f'   Formato: Lista direta')
-                elif isinstance(data, dict):
-                    eventos = data.get('eventos', [])
-                    add_log('INFO', f'   Formato: Objeto com chave "eventos"')
-                else:
-                    add_log('ERROR', f'   Formato inesperado: {type(data)}')
-                    eventos = []
-                
-                add_log('INFO', f'✓ {len(eventos)} eventos encontrados no período')
-                return eventos
+                # Sondagens que teriam sido feitas antes de chegar nesta estratégia
+                system_state['stats']['sondagens_auth_economizadas'] += list(ESTRATEGIAS_AUTH).index(preferida)
+                return response
             
-            # TESTE 3: token_usuario como header
-            add_log('INFO', f'   🧪 TESTE 3: token_usuario como header separado')
-            headers3 = {
-                "Authorization": f"Bearer {token_cache['bearer_token']}",
-                "token_usuario": token_cache['user_token'],
-                "Content-Type": "application/json"
-            }
+            if response.status_code not in (401, 403):
+                add_log('ERROR', f'❌ Erro HTTP {response.status_code}: {response.text[:300]}')
+                return response
             
-            response = requests.post(url, json=payload, headers=headers3, timeout=30)
+            add_log('WARNING', f'⚠️ Estratégia {preferida} recusada (HTTP {response.status_code}), testando as demais...')
+            recusada = response
+        
+        response = None
+        for estrategia, descricao in ESTRATEGIAS_AUTH.items():
+            if estrategia == preferida:
+                continue
+            
+            add_log('INFO', f'   🧪 TESTE {estrategia}: {descricao}')
+            response = self.sessao.post(url, json=payload, headers=self._headers_listagem(estrategia), timeout=30)
             add_log('INFO', f'   Status: {response.status_code}')
             
             if response.status_code == 200:
-                add_log('SUCCESS', '✓ FUNCIONOU com token_usuario!')
-                data = response.json()
-                
-                # A API pode retornar lista direta ou objeto com 'eventos'
-                if isinstance(data, list):
-                    eventos = data
-                    add_log('INFO', f'   Formato: Lista direta')
-                elif isinstance(data, dict):
-                    eventos = data.get('eventos', [])
-                    add_log('INFO', f'   Formato: Objeto com chave "eventos"')
-                else:
-                    add_log('ERROR', f'   Formato inesperado: {type(data)}')
-                    eventos = []
-                
-                add_log('INFO', f'✓ {len(eventos)} eventos encontrados no período')
-                return eventos
-            
-            # Se nenhuma funcionou
-            add_log('ERROR', '❌ Todas as 3 tentativas falharam!')
-            add_log('ERROR', f'   Última resposta: {response.text[:300]}')
+                add_log('SUCCESS', f'✓ FUNCIONOU com {descricao}!')
+                self._lembrar_estrategia(estrategia)
+                return response
             
-            # Tentar reautenticar
-            add_log('WARNING', '⚠️ Tentando reautenticar...')
-            if self.autenticar(force=True):
-                # Repetir teste 2 com novo token
-                headers2["Authorization"] = f"Bearer {token_cache['bearer_token']}"
-                headers2["token"] = token_cache['user_token']
-                response = requests.post(url, json=payload, headers=headers2, timeout=30)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    # A API pode retornar lista direta ou objeto com 'eventos'
-                    if isinstance(data, list):
-                        eventos = data
-                    elif isinstance(data, dict):
-                        eventos = data.get('eventos', [])
-                    else:
-                        eventos = []
-                    
-                    add_log('SUCCESS', f'✓ {len(eventos)} eventos encontrados após reautenticação')
+            if response.status_code in (401, 403) and recusada is None:
+                recusada = response
+        
+        add_log('ERROR', '❌ Nenhuma estratégia de autenticação funcionou!')
+        add_log('ERROR', f'   Última resposta: {response.text[:300]}')
+        # Uma recusa de autenticação tem prioridade: é ela que leva à reautenticação
+        return recusada or response
+    
+    @staticmethod
+    def _extrair_eventos(data):
+        """A API pode retornar lista direta ou objeto com 'eventos'"""
+        if isinstance(data, list):
+            return data
+        if isinstance(data, dict):
+            return data.get('eventos', [])
+        add_log('ERROR', f'   Formato inesperado: {type(data)}')
+        return []
+    
+    def _listar(self, url, payload, compactar=True):
+        """Uma chamada a listar/evento
+        
+        Retorna (eventos, status_code); eventos é None em caso de falha.
+        Com `compactar`, cada evento vira um EventoHinova e o JSON cru da
+        resposta é liberado ao sair daqui.
+        """
+        response = self._post_listagem(url, payload)
+        
+        # Token recusado em todas as estratégias: reautenticar e tentar de novo.
+        # O lock evita que várias fatias reautentiquem ao mesmo tempo.
+        if response.status_code in (401, 403):
+            token_recusado = token_cache['user_token']
+            with self._auth_lock:
+                if token_cache['user_token'] == token_recusado:
+                    add_log('WARNING', '⚠️ Tentando reautenticar...')
+                    self.autenticar(force=True)
+            response = self._post_listagem(url, payload)
+        
+        if response.status_code != 200:
+            return None, response.status_code
+        
+        eventos = self._extrair_eventos(response.json())
+        if compactar:
+            eventos = [EventoHinova.da_api(evento) for evento in eventos if isinstance(evento, dict)]
+        return eventos, 200
+    
+    def _listar_com_retentativas(self, url, payload, tentativas, compactar=True):
+        """Repete a chamada em falhas transitórias (rede, timeout, 429, 5xx)"""
+        descricao = f'{payload["data_cadastro"]} a {payload["data_cadastro_final"]}'
+        
+        for tentativa in range(1, tentativas + 1):
+            try:
+                eventos, status = self._listar(url, payload, compactar)
+                if eventos is not None:
                     return eventos
+                transitoria = status == 429 or status >= 500
+                erro = f'HTTP {status}'
+            except requests.exceptions.RequestException as e:
+                transitoria = True
+                erro = str(e)
+            
+            if not transitoria or tentativa == tentativas:
+                add_log('ERROR', f'❌ Falha na busca de {descricao}: {erro}')
+                return None
+            
+            espera = 2 ** (tentativa - 1)
+            add_log('WARNING', f'⚠️ Busca de {descricao} falhou ({erro}), nova tentativa em {espera}s...')
+            time.sleep(espera)
+    
+    @staticmethod
+    def deduplicar_eventos(eventos):
+        """Remove eventos repetidos (mesmo 'codigo') mantendo a primeira ocorrência"""
+        vistos = set()
+        unicos = []
+        for evento in eventos:
+            if isinstance(evento, EventoHinova):
+                chave = evento.codigo or (evento.protocolo, evento.situacao_evento)
+            else:
+                chave = evento.get('codigo') or (evento.get('protocolo'), evento.get('situacao_evento'))
+            if chave in vistos:
+                continue
+            vistos.add(chave)
+            unicos.append(evento)
+        return unicos
+    
+    @staticmethod
+    def fatiar_periodo(data_inicio, data_fim, dias_por_fatia=1):
+        """Divide o período (YYYY-MM-DD) em fatias de `dias_por_fatia` dias, no formato DD/MM/YYYY"""
+        inicio = datetime.strptime(data_inicio, '%Y-%m-%d')
+        fim = datetime.strptime(data_fim, '%Y-%m-%d')
+        dias_por_fatia = max(1, dias_por_fatia)
+        fatias = []
+        while inicio <= fim:
+            fim_fatia = min(inicio + timedelta(days=dias_por_fatia - 1), fim)
+            fatias.append((inicio.strftime('%d/%m/%Y'), fim_fatia.strftime('%d/%m/%Y')))
+            inicio = fim_fatia + timedelta(days=1)
+        return fatias
+    
+    def listar_eventos(self, data_inicio, data_fim, situacoes=None, situacoes_por_requisicao=30,
+                       dias_por_fatia=1, max_workers=4, tentativas=3, compactar=True):
+        """Lista eventos por período
+        
+        O período é dividido em fatias de `dias_por_fatia` dias buscadas em
+        paralelo (até `max_workers` requisições simultâneas), cada uma com
+        até `tentativas` tentativas em falhas transitórias. Com `situacoes`,
+        o filtro vai para a API no campo "evento_situacao" (códigos internos,
+        os mesmos de situacoes_ativas), em lotes de até
+        `situacoes_por_requisicao` códigos.
+        
+        Os eventos vêm como EventoHinova (compactar=False devolve os dicts
+        crus da API, usado só no diagnóstico) e são unidos e deduplicados
+        por 'codigo'. Se alguma
+        requisição falhar, retorna o que foi obtido e deixa
+        `ultima_listagem_completa` como False.
+        """
+        self.ultima_listagem_completa = False
+        try:
+            add_log('INFO', f'📋 Buscando eventos de {data_inicio} até {data_fim}...')
             
-            return []
+            url = f"{self.base_url}/listar/evento"
+            
+            # Datas no formato DD/MM/YYYY que a API espera, uma fatia por requisição
+            fatias = self.fatiar_periodo(data_inicio, data_fim, dias_por_fatia)
+            
+            situacoes = list(situacoes or [])
+            situacoes_por_requisicao = max(1, situacoes_por_requisicao)
+            lotes = [situacoes[i:i + situacoes_por_requisicao]
+                     for i in range(0, len(situacoes), situacoes_por_requisicao)] or [None]
+            
+            # A API Hinova usa campos diferentes!
+            payloads = []
+            for data_inicio_br, data_fim_br in fatias:
+                for lote in lotes:
+                    payload = {
+                        "data_cadastro": data_inicio_br,
+                        "data_cadastro_final": data_fim_br
+                    }
+                    if lote:
+                        payload["evento_situacao"] = lote
+                    payloads.append(payload)
+            
+            if situacoes:
+                add_log('INFO', f'   🔎 Filtro no servidor: {len(situacoes)} situações em {len(lotes)} lote(s)')
+            add_log('INFO', f'   🧵 {len(payloads)} requisições ({len(fatias)} fatias de {dias_por_fatia} dia(s)), '
+                            f'até {max_workers} em paralelo')
+            
+            # A primeira requisição vai sozinha: se for preciso sondar a estratégia
+            # de autenticação ou reautenticar, isso acontece uma vez só
+            resultados = [self._listar_com_retentativas(url, payloads[0], tentativas, compactar)]
+            
+            if len(payloads) > 1:
+                with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(payloads) - 1))) as executor:
+                    resultados.extend(executor.map(
+                        lambda payload: self._listar_com_retentativas(url, payload, tentativas, compactar),
+                        payloads[1:]
+                    ))
+            
+            eventos = []
+            falhas = 0
+            for parcial in resultados:
+                if parcial is None:
+                    falhas += 1
+                    continue
+                eventos.extend(parcial)
+            
+            eventos = self.deduplicar_eventos(eventos)
+            
+            self.ultima_listagem_completa = falhas == 0
+            if falhas:
+                add_log('WARNING', f'⚠️ {falhas} de {len(payloads)} requisições falharam')
+            add_log('INFO', f'✓ {len(eventos)} eventos encontrados no período')
+            return eventos
             
         except Exception as e:
             add_log('ERROR', f'❌ Erro ao listar eventos: {str(e)}')
@@ -613,7 +1532,7 @@ class HinovaAPI:
             
             add_log('INFO', f'   Buscando veículo {veiculo_id}...')
             
-            response = requests.get(url, headers=headers, timeout=30)
+            response = self.sessao.get(url, headers=headers, timeout=30)
             
             # Se token expirou, reautenticar
             if response.status_code == 401:
@@ -621,7 +1540,7 @@ class HinovaAPI:
                 if self.autenticar(force=True):
                     headers["Authorization"] = f"Bearer {token_cache['bearer_token']}"
                     headers["token"] = token_cache['user_token']
-                    response = requests.get(url, headers=headers, timeout=30)
+                    response = self.sessao.get(url, headers=headers, timeout=30)
             
             response.raise_for_status()
             return response.json()
@@ -631,15 +1550,155 @@ class HinovaAPI:
             return None
 
 
+class LimitadorTaxa:
+    """Token bucket para os envios à UppChannel
+    
+    Dois baldes: `por_segundo` e `por_minuto` envios (0 desativa o balde).
+    Cada envio precisa de uma ficha em ambos; sem ficha, a thread espera.
+    
+    Um 429 pausa todos os envios pelo Retry-After (ou `pausa_padrao`
+    segundos) e corta a taxa por segundo pela metade; cada envio aceito
+    devolve 10% da taxa até voltar ao configurado. Um Retry-After acima
+    de `pausa_maxima` não vira espera: os envios ficam bloqueados até lá
+    (bloqueio_restante() > 0) e falham na hora, indo para a outbox.
+    """
+    
+    def __init__(self, por_segundo=5, por_minuto=200, pausa_padrao=2.0, pausa_maxima=60.0):
+        self.por_segundo = por_segundo
+        self.por_minuto = por_minuto
+        self.pausa_padrao = pausa_padrao
+        self.pausa_maxima = pausa_maxima
+        self.taxa_segundo = float(por_segundo)
+        self._fichas_segundo = float(por_segundo)
+        self._fichas_minuto = float(por_minuto)
+        self._atualizado = time.monotonic()
+        self._pausa_ate = 0.0
+        self._bloqueado_ate = 0.0
+        self._lock = Lock()
+        self.metricas = {
+            'aguardando': 0,
+            'adquiridos': 0,
+            'espera_total_s': 0.0,
+            'espera_max_s': 0.0,
+            'respostas_429': 0
+        }
+    
+    def _repor(self, agora):
+        decorrido = agora - self._atualizado
+        self._atualizado = agora
+        if self.por_segundo:
+            self._fichas_segundo = min(max(self.taxa_segundo, 1.0), self._fichas_segundo + decorrido * self.taxa_segundo)
+        if self.por_minuto:
+            self._fichas_minuto = min(self.por_minuto, self._fichas_minuto + decorrido * self.por_minuto / 60)
+    
+    def adquirir(self):
+        """Bloqueia até haver ficha nos dois baldes; retorna os segundos de espera"""
+        inicio = time.monotonic()
+        with self._lock:
+            self.metricas['aguardando'] += 1
+        
+        try:
+            while True:
+                with self._lock:
+                    agora = time.monotonic()
+                    self._repor(agora)
+                    espera = self._pausa_ate - agora
+                    
+                    if espera <= 0:
+                        falta_segundo = (1 - self._fichas_segundo) / self.taxa_segundo if self.por_segundo else 0
+                        falta_minuto = (1 - self._fichas_minuto) * 60 / self.por_minuto if self.por_minuto else 0
+                        espera = max(falta_segundo, falta_minuto)
+                        
+                        if espera <= 0:
+                            if self.por_segundo:
+                                self._fichas_segundo -= 1
+                            if self.por_minuto:
+                                self._fichas_minuto -= 1
+                            break
+                
+                time.sleep(espera)
+        finally:
+            esperado = time.monotonic() - inicio
+            with self._lock:
+                self.metricas['aguardando'] -= 1
+                self.metricas['adquiridos'] += 1
+                self.metricas['espera_total_s'] += esperado
+                self.metricas['espera_max_s'] = max(self.metricas['espera_max_s'], esperado)
+        
+        return esperado
+    
+    def registrar_429(self, retry_after=None):
+        """Pausa os envios e reduz a taxa; retorna a pausa pedida em segundos
+        
+        Acima de `pausa_maxima` a pausa não é aplicada no token bucket e
+        sim como bloqueio: quem chama deve desistir do envio.
+        """
+        pausa = self.pausa_padrao
+        if retry_after:
+            try:
+                pausa = float(retry_after)
+            except ValueError:
+                try:
+                    pausa = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    pass
+        pausa = max(pausa, 0.0)
+        
+        with self._lock:
+            self.metricas['respostas_429'] += 1
+            if pausa > self.pausa_maxima:
+                self._bloqueado_ate = max(self._bloqueado_ate, time.monotonic() + pausa)
+            else:
+                self._pausa_ate = max(self._pausa_ate, time.monotonic() + pausa)
+            if self.por_segundo:
+                self.taxa_segundo = max(self.taxa_segundo / 2, 0.1)
+                self._fichas_segundo = 0.0
+        return pausa
+    
+    def bloqueio_restante(self):
+        """Segundos até o fim de um bloqueio por Retry-After longo (0 se livre)"""
+        return max(self._bloqueado_ate - time.monotonic(), 0.0)
+    
+    def registrar_sucesso(self):
+        if self.por_segundo and self.taxa_segundo < self.por_segundo:
+            with self._lock:
+                self.taxa_segundo = min(self.por_segundo, self.taxa_segundo + self.por_segundo * 0.1)
+    
+    def estatisticas(self):
+        with self._lock:
+            adquiridos = self.metricas['adquiridos']
+            return {
+                'fila': self.metricas['aguardando'],
+                'enviados': adquiridos,
+                'espera_media_ms': round(self.metricas['espera_total_s'] / adquiridos * 1000, 1) if adquiridos else 0,
+                'espera_max_ms': round(self.metricas['espera_max_s'] * 1000, 1),
+                'respostas_429': self.metricas['respostas_429'],
+                'taxa_atual_por_segundo': round(self.taxa_segundo, 2),
+                'limite_por_segundo': self.por_segundo,
+                'limite_por_minuto': self.por_minuto,
+                'bloqueado_por_s': round(max(self._bloqueado_ate - time.monotonic(), 0.0))
+            }
+
+
+limitador_uppchannel = LimitadorTaxa(
+    por_segundo=int(os.getenv('UPPCHANNEL_LIMITE_SEGUNDO', '5')),
+    por_minuto=int(os.getenv('UPPCHANNEL_LIMITE_MINUTO', '200')),
+    pausa_maxima=float(os.getenv('UPPCHANNEL_PAUSA_MAXIMA_S', '60'))
+)
+
+
 class UppChannelAPI:
     """Cliente para API UppChannel"""
     
-    def __init__(self, api_key):
+    def __init__(self, api_key, sessao=None, limitador=None, tentativas_429=3):
         self.api_key = api_key
         self.base_url = "https://api.uppchannel.com.br/chat"
+        self.sessao = sessao or obter_sessao_http('uppchannel')
+        self.limitador = limitador or limitador_uppchannel
+        self.tentativas_429 = tentativas_429
     
     def enviar_mensagem(self, telefone, mensagem):
-        """Envia mensagem via WhatsApp"""
+        """Envia mensagem via WhatsApp, respeitando o limite de taxa"""
         try:
             url = f"{self.base_url}/v1/message/send"
             headers = {
@@ -651,21 +1710,129 @@ class UppChannelAPI:
                 "message": mensagem
             }
             
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
+            for tentativa in range(1, self.tentativas_429 + 1):
+                # Retry-After longo: falha na hora e a outbox reenvia depois
+                bloqueio = self.limitador.bloqueio_restante()
+                if bloqueio > 0:
+                    add_log('ERROR', f'❌ Envio para {telefone} adiado: UppChannel bloqueou os envios '
+                                     f'por mais {bloqueio:.0f}s (429)')
+                    return False
+                
+                self.limitador.adquirir()
+                response = self.sessao.post(url, json=payload, headers=headers, timeout=30)
+                
+                if response.status_code == 429:
+                    pausa = self.limitador.registrar_429(response.headers.get('Retry-After'))
+                    if pausa > self.limitador.pausa_maxima:
+                        continue
+                    add_log('WARNING', f'⚠️ UppChannel limitou os envios (429), pausando {pausa:.1f}s '
+                                       f'(tentativa {tentativa}/{self.tentativas_429})')
+                    continue
+                
+                response.raise_for_status()
+                self.limitador.registrar_sucesso()
+                
+                add_log('SUCCESS', f'✓ Mensagem enviada para {telefone}')
+                return True
             
-            add_log('SUCCESS', f'✓ Mensagem enviada para {telefone}')
-            return True
+            add_log('ERROR', f'❌ Envio para {telefone} recusado por limite de taxa (429) após {self.tentativas_429} tentativas')
+            return False
             
         except Exception as e:
             add_log('ERROR', f'❌ Erro ao enviar para {telefone}: {str(e)}')
             return False
 
 
-# ==================== CONFIGURAÇÃO ====================
+# ==================== CONFIGURAÇÃO ====================
+
+# Parâmetros da busca/envio que precisam ser inteiros >= 1 (valor padrão)
+PARAMETROS_MINIMO_UM = {
+    'situacoes_por_requisicao': 30,
+    'busca_dias_por_fatia': 1,
+    'busca_workers': 4,
+    'busca_tentativas': 3,
+    'envio_concorrencia': 4,
+}
+
+def normalizar_configuracao(config):
+    """Cópia da configuração com os parâmetros numéricos limitados a >= 1
+    
+    Zero ou negativo em busca_dias_por_fatia travaria fatiar_periodo em
+    laço infinito e em situacoes_por_requisicao quebraria o range dos lotes;
+    valores inválidos voltam ao padrão.
+    """
+    config = dict(config)
+    for chave, padrao in PARAMETROS_MINIMO_UM.items():
+        if chave not in config:
+            continue
+        try:
+            valor = int(config[chave])
+        except (TypeError, ValueError):
+            add_log('WARNING', f'⚠️ {chave} inválido ({config[chave]!r}), usando {padrao}')
+            valor = padrao
+        if valor < 1:
+            add_log('WARNING', f'⚠️ {chave}={valor} ajustado para 1')
+            valor = 1
+        config[chave] = valor
+    return config
+
+
+class CacheConfiguracao:
+    """Configuração do processo, lida uma vez e mantida em memória
+    
+    carregar_configuracao() devolve o mesmo dict até POST /api/config
+    chamar recarregar(). A nova configuração é montada por completo e só
+    então trocada (troca de referência sob lock), então quem já pegou a
+    anterior continua com um dict consistente. O dict é somente leitura.
+    
+    Leitura do banco e troca acontecem sob o mesmo lock: com dois
+    recarregar() simultâneos, o que leu a linha mais antiga nunca troca
+    por último. Quem grava a configuração usa escrita() para gravar e
+    recarregar na mesma seção.
+    """
+    
+    def __init__(self, leitor):
+        self._leitor = leitor
+        self._lock = threading.RLock()
+        self._estado = None
+        self.versao = 0
+    
+    def _montar(self):
+        """Lê a configuração e compila seus templates de mensagem"""
+        config = normalizar_configuracao(self._leitor())
+        templates, erros = compilar_templates(config.get('templates_mensagem') or {})
+        for erro in erros:
+            add_log('WARNING', f'⚠️ {erro} (usando template padrão)')
+        return config, templates, ClassificadorSituacoes(config.get('situacoes_ativas') or [])
+    
+    def instantaneo(self):
+        """(config, templates compilados, classificador de situações) da mesma versão"""
+        estado = self._estado
+        if estado is not None:
+            return estado
+        with self._lock:
+            if self._estado is None:
+                self._estado = self._montar()
+                self.versao += 1
+            return self._estado
+    
+    def obter(self):
+        return self.instantaneo()[0]
+    
+    def recarregar(self):
+        """Relê banco/ambiente e troca a configuração atomicamente"""
+        with self._lock:
+            self._estado = self._montar()
+            self.versao += 1
+            return self._estado[0]
+    
+    def escrita(self):
+        """Lock (reentrante) das trocas, para gravar e recarregar juntos"""
+        return self._lock
+
 
-def carregar_configuracao():
-    """Carrega configuração das variáveis de ambiente ou banco"""
+def ler_configuracao():
+    """Lê a configuração das variáveis de ambiente ou banco (sem cache)"""
     # Tentar carregar do banco primeiro
     config_db = get_config('main_config')
     
@@ -685,7 +1852,18 @@ def carregar_configuracao():
         },
         'situacoes_ativas': [int(x) for x in os.getenv('SITUACOES_ATIVAS', '6,15,11,23,38,80,82,30,40,5,10,3,45,77,76,33,8,29,70,71,72,79,32,59,4,20,61').split(',')],
         'intervalo_minutos': int(os.getenv('INTERVALO_MINUTOS', '15')),
-        'dias_busca': int(os.getenv('DIAS_BUSCA', '7'))  # NOVO: Quantos dias buscar no passado
+        'dias_busca': int(os.getenv('DIAS_BUSCA', '7')),  # NOVO: Quantos dias buscar no passado
+        'filtro_situacao_servidor': os.getenv('FILTRO_SITUACAO_SERVIDOR', 'true').lower() == 'true',
+        'situacoes_por_requisicao': int(os.getenv('SITUACOES_POR_REQUISICAO', '30')),
+        'modo_incremental': os.getenv('MODO_INCREMENTAL', 'false').lower() == 'true',
+        'intervalo_varredura_completa_horas': int(os.getenv('INTERVALO_VARREDURA_COMPLETA_HORAS', '6')),
+        'busca_dias_por_fatia': int(os.getenv('BUSCA_DIAS_POR_FATIA', '1')),
+        'busca_workers': int(os.getenv('BUSCA_WORKERS', '4')),
+        'busca_tentativas': int(os.getenv('BUSCA_TENTATIVAS', '3')),
+        'envio_concorrencia': int(os.getenv('ENVIO_CONCORRENCIA', '4')),
+        'reenvio_max_tentativas': int(os.getenv('REENVIO_MAX_TENTATIVAS', '5')),
+        'reenvio_intervalo_base_s': int(os.getenv('REENVIO_INTERVALO_BASE_S', '60')),
+        'reenvio_intervalo_max_s': int(os.getenv('REENVIO_INTERVALO_MAX_S', '3600'))
     }
     
     # Templates padrão
@@ -698,6 +1876,13 @@ def carregar_configuracao():
     return config
 
 
+configuracao = CacheConfiguracao(ler_configuracao)
+
+def carregar_configuracao():
+    """Configuração atual (em cache; recarregada só quando é alterada)"""
+    return configuracao.obter()
+
+
 # ==================== MAPEAMENTO DE SITUAÇÕES ====================
 
 # Mapeamento: código da API Hinova ("2.1", "3.0", etc.) → código interno do sistema
@@ -770,74 +1955,165 @@ SITUACAO_NOME_PARA_INTERNO = {
     "FINALIZADO REPAROS PELO TERCEIRO": 20,
 }
 
-def mapear_situacao_api_para_interno(codigo_api, nome_situacao):
-    """Mapeia o código da API Hinova para o código interno do sistema
+def normalizar_nome_situacao(nome):
+    """Maiúsculas, sem acentos e com espaços simples ("Análise " -> "ANALISE")"""
+    decomposto = unicodedata.normalize('NFD', str(nome))
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.upper().split())
+
+
+SituacaoClassificada = namedtuple('SituacaoClassificada', 'codigo_api nome codigo ativa')
+
+
+class ClassificadorSituacoes:
+    """Converte o campo situacao_evento da API no código interno do sistema
     
-    A API retorna: "2.1 - ANÁLISE" → código_api="2.1", nome="ANÁLISE"
-    O sistema usa: código interno 15 para ANÁLISE
+    A API retorna "2.1 - ANÁLISE": o código da API ("2.1") é procurado em
+    SITUACAO_API_PARA_INTERNO e, se não houver, o nome sem acentos em
+    SITUACAO_NOME_PARA_INTERNO. Montado junto com a configuração (depende
+    de situacoes_ativas); cada string crua é classificada uma única vez e
+    as seguintes são um acesso ao dicionário. Situações não mapeadas são
+    registradas no log só na primeira vez que aparecem.
     """
-    # Tentar pelo código da API primeiro
-    if codigo_api in SITUACAO_API_PARA_INTERNO:
-        codigo_interno = SITUACAO_API_PARA_INTERNO[codigo_api]
-        add_log('INFO', f'   📋 Mapeamento: API "{codigo_api}" → interno {codigo_interno} ({nome_situacao})')
-        return codigo_interno
-    
-    # Fallback: tentar pelo nome
-    nome_upper = str(nome_situacao).upper().strip()
-    if nome_upper in SITUACAO_NOME_PARA_INTERNO:
-        codigo_interno = SITUACAO_NOME_PARA_INTERNO[nome_upper]
-        add_log('INFO', f'   📋 Mapeamento por nome: "{nome_situacao}" → interno {codigo_interno}')
-        return codigo_interno
-    
-    # Não encontrado
-    add_log('WARNING', f'   ⚠️ Situação não mapeada: código API="{codigo_api}", nome="{nome_situacao}"')
-    return None
+    
+    MAXIMO_MEMORIZADAS = 4096
+    
+    def __init__(self, situacoes_ativas):
+        self.ativas = frozenset(situacoes_ativas)
+        self._por_nome = {normalizar_nome_situacao(nome): codigo for nome, codigo in SITUACAO_NOME_PARA_INTERNO.items()}
+        self._memo = {}
+    
+    def classificar(self, situacao_evento):
+        situacao = self._memo.get(situacao_evento)
+        if situacao is None:
+            situacao = self._classificar(situacao_evento)
+            if len(self._memo) >= self.MAXIMO_MEMORIZADAS:
+                self._memo.clear()
+            self._memo[situacao_evento] = situacao
+        return situacao
+    
+    def _classificar(self, situacao_evento):
+        texto = str(situacao_evento)
+        if ' - ' in texto:
+            codigo_api, nome = (parte.strip() for parte in texto.split(' - ', 1))
+        else:
+            codigo_api, nome = texto.strip(), situacao_evento
+        
+        codigo = SITUACAO_API_PARA_INTERNO.get(codigo_api)
+        if codigo is None:
+            codigo = self._por_nome.get(normalizar_nome_situacao(nome))
+        if codigo is None:
+            add_log('WARNING', f'   ⚠️ Situação não mapeada: código API="{codigo_api}", nome="{nome}"')
+        
+        return SituacaoClassificada(codigo_api, nome, codigo, codigo is not None and codigo in self.ativas)
 
 
 # ==================== PROCESSAMENTO ====================
 
-def formatar_mensagem(template, evento, veiculo_data):
-    """Formata mensagem substituindo variáveis"""
+# ==================== TEMPLATES DE MENSAGEM ====================
+
+# Variáveis disponíveis nos templates ({nome_associado}, {protocolo}, ...)
+PLACEHOLDERS_MENSAGEM = frozenset({'nome_associado', 'protocolo', 'placa', 'situacao', 'motivo', 'data_evento'})
+
+
+class TemplateMensagem:
+    """Template compilado: trechos fixos e variáveis já separados
+    
+    O texto é analisado uma única vez (na carga da configuração) e os
+    placeholders validados; renderizar só concatena os trechos.
+    """
+    
+    __slots__ = ('texto', '_trechos')
+    
+    def __init__(self, texto):
+        trechos = []
+        try:
+            partes = list(string.Formatter().parse(texto))
+        except ValueError as e:
+            raise ValueError(f'chaves mal formadas ({e})')
+        for literal, campo, especificacao, conversao in partes:
+            if campo is not None:
+                if campo not in PLACEHOLDERS_MENSAGEM:
+                    raise ValueError(f'placeholder desconhecido {{{campo}}}')
+                if especificacao or conversao:
+                    raise ValueError(f'formatação não suportada em {{{campo}}}')
+            trechos.append((literal, campo))
+        self.texto = texto
+        self._trechos = tuple(trechos)
+    
+    def renderizar(self, campos):
+        """Monta a mensagem a partir dos campos (strings) do evento"""
+        return ''.join([literal + campos[campo] if campo else literal for literal, campo in self._trechos])
+
+
+def compilar_templates(templates):
+    """Compila os templates da configuração; retorna (compilados, erros)
+    
+    Templates inválidos ficam de fora (o evento usa o template padrão) e
+    são descritos em `erros`.
+    """
+    compilados, erros = {}, []
+    for codigo, texto in templates.items():
+        try:
+            compilados[str(codigo)] = TemplateMensagem(texto)
+        except (ValueError, TypeError) as e:
+            erros.append(f'Template da situação {codigo} inválido: {e}')
+    return compilados, erros
+
+
+@lru_cache(maxsize=256)
+def template_padrao(situacao_nome):
+    """Template padrão de uma situação sem template configurado (compilado uma vez)"""
+    nome = str(situacao_nome).replace('{', '{{').replace('}', '}}')
+    return TemplateMensagem(f"Olá {{nome_associado}}!\n\n*{nome}*\n\nProtocolo: {{protocolo}}\nVeículo: {{placa}}\nData: {{data_evento}}")
+
+
+@lru_cache(maxsize=1024)
+def converter_data_evento(data_evento):
+    """YYYY-MM-DD -> DD/MM/YYYY; outros formatos passam como estão
+    
+    Memoizada: uma janela de busca tem poucas datas distintas, então o
+    strptime roda uma vez por data e não uma vez por evento.
+    """
+    if '-' in data_evento and len(data_evento) == 10:
+        try:
+            return datetime.strptime(data_evento, '%Y-%m-%d').strftime('%d/%m/%Y')
+        except ValueError:
+            pass
+    return data_evento
+
+
+def campos_mensagem(evento, veiculo_api=None):
+    """Campos de um EventoHinova usados pelos templates, calculados uma vez por evento
+    
+    `veiculo_api` é o retorno de buscar_veiculo quando o evento veio sem
+    telefone; seus dados completam nome e placa.
+    """
+    associado_veiculo = veiculo_api.get('associado', {}) if isinstance(veiculo_api, dict) else {}
+    
+    nome = evento.nome_associado or associado_veiculo.get('nome') or 'Cliente'
+    placa = (veiculo_api.get('placa') if isinstance(veiculo_api, dict) else None) or evento.placa or 'N/A'
+    
+    # Situação: campo direto "situacao_evento" (string)
+    situacao_str = str(evento.situacao_evento or 'N/A')
+    situacao_nome = situacao_str.split(' - ', 1)[1] if ' - ' in situacao_str else situacao_str
+    
+    data_evento = evento.data_evento or datetime.now().strftime('%d/%m/%Y')
+    
+    return {
+        'nome_associado': str(nome),
+        'protocolo': str(evento.protocolo if evento.protocolo is not None else 'N/A'),
+        'placa': str(placa),
+        'situacao': situacao_nome,
+        'motivo': str(evento.motivo),
+        'data_evento': converter_data_evento(str(data_evento))
+    }
+
+
+def formatar_mensagem(template, evento, veiculo_api=None):
+    """Formata mensagem com um template compilado (TemplateMensagem)"""
     try:
-        # Dados do associado (podem vir do evento ou do veículo)
-        associado_evento = evento.get('associado', {})
-        associado_veiculo = veiculo_data.get('associado', {}) if isinstance(veiculo_data, dict) else {}
-        
-        nome = associado_evento.get('nome') or associado_veiculo.get('nome') or 'Cliente'
-        placa = (veiculo_data.get('placa') if isinstance(veiculo_data, dict) else None) or evento.get('veiculo', {}).get('placa', 'N/A')
-        
-        # Situação: campo direto "situacao_evento" (string)
-        situacao_str = evento.get('situacao_evento', 'N/A')
-        if ' - ' in str(situacao_str):
-            situacao_nome = str(situacao_str).split(' - ', 1)[1]
-        else:
-            situacao_nome = str(situacao_str)
-        
-        # Motivo: campo direto "motivo" (string na API real)
-        motivo = evento.get('motivo', 'N/A')
-        if isinstance(motivo, dict):
-            motivo = motivo.get('nome', 'N/A')
-        
-        # Data do evento
-        data_evento = evento.get('data_evento', datetime.now().strftime('%d/%m/%Y'))
-        # Converter de YYYY-MM-DD para DD/MM/YYYY se necessário
-        if data_evento and '-' in str(data_evento) and len(str(data_evento)) == 10:
-            try:
-                data_evento = datetime.strptime(str(data_evento), '%Y-%m-%d').strftime('%d/%m/%Y')
-            except:
-                pass
-        
-        mensagem = template.format(
-            nome_associado=nome,
-            protocolo=evento.get('protocolo', 'N/A'),
-            placa=placa,
-            situacao=situacao_nome,
-            motivo=motivo,
-            data_evento=data_evento
-        )
-        
-        return mensagem
-        
+        return template.renderizar(campos_mensagem(evento, veiculo_api))
     except Exception as e:
         add_log('ERROR', f'❌ Erro ao formatar mensagem: {str(e)}')
         return None
@@ -865,12 +2141,232 @@ def extrair_telefone(associado_data):
         return None
 
 
-def processar_eventos():
-    """Função principal de processamento - VERSÃO CORRIGIDA"""
-    if system_state['is_running']:
-        add_log('WARNING', '⚠️ Processamento já em execução, pulando...')
+def despachar_mensagens(uppchannel, envios, ao_concluir, max_concorrencia=4, apos_lote=None):
+    """Envia as mensagens em paralelo, mantendo a ordem por telefone
+    
+    As mensagens de um mesmo telefone formam uma fila enviada em sequência
+    por uma única thread; telefones diferentes são atendidos em paralelo por
+    até `max_concorrencia` threads. `ao_concluir(envio, enviado)` é chamada
+    na thread que chamou esta função, uma vez por mensagem, assim que o
+    envio termina; `apos_lote()` é chamada depois de cada leva de resultados
+    já disponíveis.
+    """
+    filas = {}
+    for envio in envios:
+        filas.setdefault(envio['telefone'], []).append(envio)
+    
+    resultados = queue.Queue()
+    
+    def enviar_fila(fila):
+        for envio in fila:
+            try:
+                enviado = uppchannel.enviar_mensagem(envio['telefone'], envio['mensagem'])
+            except Exception as e:
+                add_log('ERROR', f'❌ Erro ao enviar para {envio["telefone"]}: {str(e)}')
+                enviado = False
+            resultados.put((envio, enviado))
+    
+    add_log('INFO', f'📤 Enviando {len(envios)} mensagens para {len(filas)} telefones '
+                    f'(até {max_concorrencia} em paralelo)')
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concorrencia, len(filas)))) as executor:
+        for fila in filas.values():
+            executor.submit(enviar_fila, fila)
+        
+        restantes = len(envios)
+        while restantes:
+            ao_concluir(*resultados.get())
+            restantes -= 1
+            # Consome o que já chegou antes de fechar a leva
+            while restantes:
+                try:
+                    resultado = resultados.get_nowait()
+                except queue.Empty:
+                    break
+                ao_concluir(*resultado)
+                restantes -= 1
+            if apos_lote:
+                apos_lote()
+
+
+def prefiltrar_eventos(eventos, classificador, historico_notificadas):
+    """Separa, em uma passada, os eventos que realmente precisam de ação
+    
+    Descarta eventos em situações inativas (ou não mapeadas), cujo
+    (protocolo, situação) já está no histórico e repetições do mesmo par
+    dentro do lote. Retorna ([(evento, situacao), ...], resumo) com as
+    contagens de cada motivo de descarte.
+    """
+    acionaveis = []
+    vistos = set()
+    inativos = ja_conhecidos = repetidos = 0
+    
+    for evento in eventos:
+        situacao = classificador.classificar(evento.situacao_evento)
+        if not situacao.ativa:
+            inativos += 1
+            continue
+        
+        chave = (evento.protocolo, situacao.codigo)
+        if chave in historico_notificadas:
+            ja_conhecidos += 1
+            continue
+        if chave in vistos:
+            repetidos += 1
+            continue
+        
+        vistos.add(chave)
+        acionaveis.append((evento, situacao))
+    
+    total = len(eventos)
+    return acionaveis, {
+        'total': total,
+        'inativos': inativos,
+        'ja_conhecidos': ja_conhecidos,
+        'repetidos': repetidos,
+        'acionaveis': len(acionaveis),
+        'reducao': round(1 - len(acionaveis) / total, 4) if total else 0.0
+    }
+
+def calcular_janela_busca(config):
+    """Define o período da busca de eventos deste ciclo
+    
+    No modo incremental a busca começa no data_cadastro da marca d'água
+    (último evento já visto), pois a API só filtra por dia. A cada
+    `intervalo_varredura_completa_horas` roda uma varredura completa de
+    `dias_busca` dias para pegar mudanças de situação de eventos antigos;
+    entre duas varreduras completas essas mudanças não são vistas, por isso
+    o modo é opcional (MODO_INCREMENTAL=true) e desligado por padrão.
+    
+    Retorna (data_inicio, data_fim, varredura_completa).
+    """
+    agora = datetime.now()
+    dias_busca = config.get('dias_busca', 7)
+    inicio_completo = (agora - timedelta(days=dias_busca)).strftime('%Y-%m-%d')
+    data_fim = agora.strftime('%Y-%m-%d')
+    
+    if not config.get('modo_incremental', False):
+        return inicio_completo, data_fim, True
+    
+    marca = get_config('hinova_marca_dagua')
+    ultima_completa = get_config('hinova_ultima_varredura_completa')
+    intervalo_completa = timedelta(hours=config.get('intervalo_varredura_completa_horas', 6))
+    
+    if not marca or not ultima_completa or agora - datetime.fromisoformat(ultima_completa) >= intervalo_completa:
+        return inicio_completo, data_fim, True
+    
+    # Nunca buscar além da janela completa, mesmo com marca d'água antiga
+    return max(marca['data_cadastro'], inicio_completo), data_fim, False
+
+
+def registrar_busca_concluida(eventos, varredura_completa):
+    """Avança a marca d'água com o evento mais recente e registra a varredura completa"""
+    marca = get_config('hinova_marca_dagua') or {}
+    atual = (marca.get('data_cadastro', ''), marca.get('hora_cadastro', ''), marca.get('codigo') or 0)
+    maior = atual
+    
+    for evento in eventos:
+        chave = (evento.data_cadastro or '', evento.hora_cadastro or '', evento.codigo or 0)
+        if chave > maior:
+            maior = chave
+    
+    if maior != atual:
+        save_config('hinova_marca_dagua', {
+            'data_cadastro': maior[0],
+            'hora_cadastro': maior[1],
+            'codigo': maior[2]
+        })
+        add_log('INFO', f'🔖 Marca d\'água atualizada: {maior[0]} {maior[1]} (código {maior[2]})')
+    
+    if varredura_completa:
+        save_config('hinova_ultima_varredura_completa', datetime.now().isoformat())
+
+
+# ==================== EXECUÇÕES (JOBS) ====================
+
+# Execuções de processar_eventos: a ativa e as mais recentes
+jobs_lock = Lock()
+jobs_estado = {
+    'ativo': None,
+    'recentes': OrderedDict(),
+    'max_recentes': 50
+}
+
+def _novo_job(origem):
+    job = {
+        'id': uuid.uuid4().hex[:12],
+        'origem': origem,
+        'status': 'enfileirado',
+        'criado_em': datetime.now().isoformat(),
+        'iniciado_em': None,
+        'concluido_em': None,
+        'resultado': None,
+        'progresso': {
+            'eventos_total': 0,
+            'eventos_vistos': 0,
+            'eventos_acionaveis': 0,
+            'enviados': 0,
+            'falhas': 0
+        }
+    }
+    jobs_estado['recentes'][job['id']] = job
+    while len(jobs_estado['recentes']) > jobs_estado['max_recentes']:
+        jobs_estado['recentes'].popitem(last=False)
+    return job
+
+def reservar_job(origem, job=None):
+    """Reserva a execução para um job; se já houver um ativo, retorna ele
+    
+    Retorna (job, reservado). Com reservado=False o chamador deve apenas
+    acompanhar o job existente: disparos simultâneos se juntam a ele.
+    """
+    with jobs_lock:
+        ativo = jobs_estado['ativo']
+        if ativo and ativo is not job and ativo['status'] in ('enfileirado', 'executando'):
+            return ativo, False
+        
+        if job is None:
+            job = _novo_job(origem)
+        jobs_estado['ativo'] = job
+        return job, True
+
+def iniciar_execucao(origem='manual'):
+    """Dispara processar_eventos em segundo plano e retorna (job, novo)"""
+    job, novo = reservar_job(origem)
+    if novo:
+        threading.Thread(
+            target=processar_eventos, kwargs={'job': job},
+            name=f'job-{job["id"]}', daemon=True
+        ).start()
+    return job, novo
+
+def consultar_job(job_id):
+    """Cópia do job para a API (com a etapa atual se estiver rodando)"""
+    with jobs_lock:
+        job = jobs_estado['recentes'].get(job_id)
+        if job is None:
+            return None
+        job = dict(job, progresso=dict(job['progresso']))
+    
+    job['progresso']['current_step'] = system_state['current_step'] if job['status'] == 'executando' else ''
+    return job
+
+
+def processar_eventos(job=None):
+    """Função principal de processamento - VERSÃO CORRIGIDA
+    
+    Sem `job` (chamada do agendador) registra um job próprio; se outro já
+    estiver ativo, esta chamada é ignorada.
+    """
+    job, reservado = reservar_job('agendador', job)
+    if not reservado:
+        add_log('WARNING', f'⚠️ Processamento já em execução (job {job["id"]}), pulando...')
         return
     
+    job['status'] = 'executando'
+    job['iniciado_em'] = datetime.now().isoformat()
+    progresso = job['progresso']
+    
     system_state['is_running'] = True
     system_state['last_run'] = datetime.now()
     system_state['stats']['total_runs'] += 1
@@ -880,17 +2376,22 @@ def processar_eventos():
     system_state['stats']['eventos_mudanca'] = 0
     system_state['stats']['eventos_sem_mudanca'] = 0
     
+    # Escritas do ciclo são agrupadas e gravadas em lote
+    escritor = EscritorLote()
+    
     try:
         add_log('INFO', '=' * 60)
         add_log('INFO', '🚀 INICIANDO PROCESSAMENTO DE EVENTOS (VERSÃO CORRIGIDA)')
         add_log('INFO', '=' * 60)
         
         system_state['current_step'] = 'Carregando configuração...'
-        config = carregar_configuracao()
+        config, templates, classificador = configuracao.instantaneo()
         
         # Validar configuração
         if not config['hinova']['token'] or not config['uppchannel']['api_key']:
             system_state['last_status'] = "❌ Erro: Credenciais não configuradas"
+            system_state['stats']['last_error'] = 'Credenciais não configuradas'
+            job['status'] = 'erro'
             add_log('ERROR', '❌ Credenciais não configuradas')
             return
         
@@ -908,12 +2409,16 @@ def processar_eventos():
         system_state['current_step'] = 'Autenticando...'
         if not hinova.autenticar():
             system_state['last_status'] = "❌ Erro na autenticação"
+            system_state['stats']['last_error'] = 'Falha na autenticação'
+            job['status'] = 'erro'
             add_log('ERROR', '❌ Falha na autenticação - verifique credenciais')
             return
         
         # Verificar se token foi obtido
         if not token_cache['user_token']:
             system_state['last_status'] = "❌ Erro: Token de usuário não obtido"
+            system_state['stats']['last_error'] = 'Token de usuário não obtido'
+            job['status'] = 'erro'
             add_log('ERROR', '❌ Token de usuário não foi retornado pela API')
             return
         
@@ -922,66 +2427,71 @@ def processar_eventos():
         # CORREÇÃO #1: Buscar eventos dos últimos X dias (não apenas hoje!)
         system_state['current_step'] = 'Buscando eventos...'
         dias_busca = config.get('dias_busca', 7)
-        data_inicio = (datetime.now() - timedelta(days=dias_busca)).strftime('%Y-%m-%d')
-        data_fim = datetime.now().strftime('%Y-%m-%d')
+        data_inicio, data_fim, varredura_completa = calcular_janela_busca(config)
         
-        add_log('INFO', f'📅 Buscando eventos dos últimos {dias_busca} dias ({data_inicio} a {data_fim})')
+        if varredura_completa:
+            add_log('INFO', f'📅 Varredura completa: eventos dos últimos {dias_busca} dias ({data_inicio} a {data_fim})')
+        else:
+            add_log('INFO', f'📅 Busca incremental a partir da marca d\'água ({data_inicio} a {data_fim})')
         
-        eventos = hinova.listar_eventos(data_inicio, data_fim)
+        # Filtrar situações no servidor: só as ativas vêm na resposta
+        situacoes_filtro = config['situacoes_ativas'] if config.get('filtro_situacao_servidor', True) else None
+        eventos = hinova.listar_eventos(
+            data_inicio, data_fim,
+            situacoes=situacoes_filtro,
+            situacoes_por_requisicao=config.get('situacoes_por_requisicao', 30),
+            dias_por_fatia=config.get('busca_dias_por_fatia', 1),
+            max_workers=config.get('busca_workers', 4),
+            tentativas=config.get('busca_tentativas', 3)
+        )
         
         if not eventos:
-            system_state['last_status'] = f"✓ Nenhum evento encontrado nos últimos {dias_busca} dias"
-            add_log('INFO', f'✓ Nenhum evento para processar nos últimos {dias_busca} dias')
+            if hinova.ultima_listagem_completa:
+                registrar_busca_concluida([], varredura_completa)
+            system_state['last_status'] = f"✓ Nenhum evento encontrado ({data_inicio} a {data_fim})"
+            add_log('INFO', f'✓ Nenhum evento para processar ({data_inicio} a {data_fim})')
             return
         
         add_log('INFO', f'📊 Total de eventos encontrados: {len(eventos)}')
+        progresso['eventos_total'] = len(eventos)
+        
+        # Carregar de uma vez o histórico dos protocolos com situação ativa
+        # (a classificação fica memorizada para o pré-filtro)
+        system_state['current_step'] = 'Carregando histórico...'
+        historico_notificadas, historico_ultimas = carregar_historico_lote(
+            evento.protocolo for evento in eventos
+            if classificador.classificar(evento.situacao_evento).ativa
+        )
+        add_log('INFO', f'📚 Histórico carregado: {len(historico_ultimas)} protocolos já conhecidos')
+        
+        # Pré-filtro: só os eventos acionáveis seguem para telefone e envio
+        acionaveis, resumo = prefiltrar_eventos(eventos, classificador, historico_notificadas)
+        eventos_analisados = resumo['total']
+        system_state['stats']['eventos_sem_mudanca'] += resumo['ja_conhecidos'] + resumo['repetidos']
+        system_state['stats']['reducao_prefiltro'] = resumo['reducao']
+        progresso['eventos_acionaveis'] = resumo['acionaveis']
+        add_log('INFO', f'🧹 Pré-filtro: {resumo["total"]} → {resumo["acionaveis"]} eventos acionáveis '
+                        f'({resumo["inativos"]} em situações inativas, {resumo["ja_conhecidos"]} já notificados, '
+                        f'{resumo["repetidos"]} repetidos; redução de {resumo["reducao"]:.1%})')
         
         # Processar eventos
-        system_state['current_step'] = f'Processando {len(eventos)} eventos...'
+        system_state['current_step'] = f'Processando {len(acionaveis)} eventos...'
         mensagens_enviadas = 0
-        eventos_analisados = 0
+        envios = []
+        descartados = len(eventos) - len(acionaveis)
+        progresso['eventos_vistos'] = descartados
         
-        for idx, evento in enumerate(eventos, 1):
+        for idx, (evento, situacao) in enumerate(acionaveis, 1):
             try:
-                system_state['current_step'] = f'Processando evento {idx}/{len(eventos)}...'
-                
-                protocolo = evento.get('protocolo')
-                
-                # CORREÇÃO CRÍTICA: A API Hinova retorna situação como string
-                # Formato: "2.1 - ANÁLISE" no campo "situacao_evento"
-                situacao_evento_str = evento.get('situacao_evento', '')
-                
-                # Extrair código e nome da string
-                if ' - ' in str(situacao_evento_str):
-                    partes = str(situacao_evento_str).split(' - ', 1)
-                    situacao_codigo_api = partes[0].strip()  # Ex: "2.1"
-                    situacao_nome = partes[1].strip()         # Ex: "ANÁLISE"
-                else:
-                    situacao_codigo_api = str(situacao_evento_str).strip()
-                    situacao_nome = situacao_evento_str
-                
-                # Mapear código da API para código interno do sistema
-                # A API usa códigos como "2.1", "3.0", etc.
-                # O sistema usa códigos numéricos internos como 15, 11, etc.
-                situacao_codigo = mapear_situacao_api_para_interno(situacao_codigo_api, situacao_nome)
+                system_state['current_step'] = f'Processando evento {idx}/{len(acionaveis)}...'
+                progresso['eventos_vistos'] = descartados + idx
                 
-                eventos_analisados += 1
-                
-                # Verificar situação ativa
-                if situacao_codigo is None or situacao_codigo not in config['situacoes_ativas']:
-                    add_log('INFO', f'⏭️ Protocolo {protocolo}: Situação "{situacao_evento_str}" (código interno: {situacao_codigo}) não está ativa')
-                    continue
-                
-                # CORREÇÃO #2: Verificar se já foi notificada
-                ja_notificada, historico = verificar_situacao_ja_notificada(protocolo, situacao_codigo)
-                
-                if ja_notificada:
-                    add_log('INFO', f'⏭️ Protocolo {protocolo}: Situação {situacao_codigo} ({situacao_nome}) já foi notificada em {historico["data_notificacao"]}')
-                    system_state['stats']['eventos_sem_mudanca'] += 1
-                    continue
+                protocolo = evento.protocolo
+                situacao_nome = situacao.nome
+                situacao_codigo = situacao.codigo
                 
                 # CORREÇÃO #3: Detectar se é novo ou mudança
-                ultima_situacao = get_ultima_situacao(protocolo)
+                ultima_situacao = historico_ultimas.get(protocolo)
                 
                 if ultima_situacao is None:
                     add_log('INFO', f'🆕 Protocolo {protocolo}: NOVO evento detectado (situação: {situacao_nome})')
@@ -992,41 +2502,31 @@ def processar_eventos():
                     add_log('INFO', f'   Situação atual: {situacao_nome} (código {situacao_codigo})')
                     system_state['stats']['eventos_mudanca'] += 1
                 
-                # Registrar que detectamos esta situação
-                registrar_situacao_detectada(protocolo, situacao_codigo, situacao_nome)
+                # A detecção vai para o banco junto com o resultado do evento
+                # (sem telefone, erro de formatação ou retorno do envio).
+                # A última situação em memória já é atualizada agora para
+                # outros eventos do mesmo protocolo neste ciclo
+                historico_ultimas[protocolo] = {
+                    'codigo': situacao_codigo,
+                    'nome': situacao_nome,
+                    'data': datetime.now().isoformat()
+                }
                 
                 add_log('INFO', f'📝 Processando notificação para protocolo {protocolo} (situação: {situacao_nome})')
                 
-                # CORREÇÃO: Dados já vêm no próprio evento, não precisa buscar separado
-                veiculo_data_evento = evento.get('veiculo', {})
-                associado_data_evento = evento.get('associado', {})
-                
-                # Extrair dados diretamente do evento
-                nome_associado = associado_data_evento.get('nome', 'Cliente')
-                placa = veiculo_data_evento.get('placa', 'N/A') if isinstance(veiculo_data_evento, dict) else 'N/A'
-                
-                # Extrair telefone do associado (campos reais da API)
-                telefone = None
-                tel_celular = associado_data_evento.get('telefone_celular', '') or ''
-                tel_fixo = associado_data_evento.get('telefone', '') or ''
-                tel_comercial = associado_data_evento.get('telefone_comercial', '') or ''
-                
-                for tel in [tel_celular, tel_fixo, tel_comercial]:
-                    if tel:
-                        tel_limpo = ''.join(filter(str.isdigit, str(tel)))
-                        if len(tel_limpo) >= 10:
-                            telefone = tel_limpo
-                            break
+                # Nome, placa e telefone já vêm no próprio evento (extraídos na leitura)
+                nome_associado = evento.nome_associado or 'Cliente'
+                placa = evento.placa or 'N/A'
+                telefone = evento.telefone
                 
                 # Se não encontrou no evento, tentar buscar veículo pela API
-                veiculo_id = veiculo_data_evento.get('codigo') if isinstance(veiculo_data_evento, dict) else evento.get('codigo_veiculo')
-                veiculo_data = veiculo_data_evento  # Usar dados do evento como base
+                veiculo_id = evento.codigo_veiculo
+                veiculo_api = None
                 
                 if not telefone and veiculo_id:
                     add_log('INFO', f'   Telefone não encontrado no evento, buscando via API...')
                     veiculo_api = hinova.buscar_veiculo(veiculo_id)
                     if veiculo_api:
-                        veiculo_data = veiculo_api
                         associado_api = veiculo_api.get('associado', {})
                         if not nome_associado or nome_associado == 'Cliente':
                             nome_associado = associado_api.get('nome', nome_associado)
@@ -1036,53 +2536,88 @@ def processar_eventos():
                 
                 if not telefone:
                     add_log('WARNING', f'⚠️ Telefone não encontrado para {protocolo}')
-                    save_message_log(
+                    escritor.registrar_situacao(protocolo, situacao_codigo, situacao_nome)
+                    escritor.salvar_mensagem(
                         protocolo, f"{protocolo}_{situacao_codigo}", situacao_codigo, situacao_nome,
                         None, None, 'ERRO', 'Telefone não encontrado',
                         nome_associado, placa
                     )
                     continue
                 
-                # Obter template
-                template = config['templates_mensagem'].get(str(situacao_codigo))
-                
-                if not template:
-                    # Template padrão
-                    template = f"Olá {{nome_associado}}!\n\n*{situacao_nome}*\n\nProtocolo: {{protocolo}}\nVeículo: {{placa}}\nData: {{data_evento}}"
+                # Template compilado na carga da configuração (ou o padrão)
+                template = templates.get(str(situacao_codigo)) or template_padrao(situacao_nome)
                 
                 # Formatar mensagem
-                mensagem = formatar_mensagem(template, evento, veiculo_data)
+                mensagem = formatar_mensagem(template, evento, veiculo_api)
                 if not mensagem:
+                    escritor.registrar_situacao(protocolo, situacao_codigo, situacao_nome)
                     continue
                 
-                # Enviar mensagem
-                if uppchannel.enviar_mensagem(telefone, mensagem):
-                    mensagens_enviadas += 1
-                    system_state['stats']['successful_messages'] += 1
-                    
-                    # CORREÇÃO #4: Marcar como notificada
-                    marcar_situacao_como_notificada(protocolo, situacao_codigo, 'ENVIADO')
-                    
-                    save_message_log(
-                        protocolo, f"{protocolo}_{situacao_codigo}", situacao_codigo, situacao_nome,
-                        telefone, mensagem, 'ENVIADO', None,
-                        nome_associado, placa
-                    )
-                else:
-                    system_state['stats']['failed_messages'] += 1
-                    marcar_situacao_como_notificada(protocolo, situacao_codigo, 'FALHOU')
-                    
-                    save_message_log(
-                        protocolo, f"{protocolo}_{situacao_codigo}", situacao_codigo, situacao_nome,
-                        telefone, mensagem, 'FALHOU', 'Erro no envio',
-                        nome_associado, placa
-                    )
+                # Enviar mensagem (no estágio de envio, após o loop)
+                envios.append({
+                    'protocolo': protocolo,
+                    'situacao_codigo': situacao_codigo,
+                    'situacao_nome': situacao_nome,
+                    'telefone': telefone,
+                    'mensagem': mensagem,
+                    'nome_associado': nome_associado,
+                    'placa': placa
+                })
                 
             except Exception as e:
                 add_log('ERROR', f'❌ Erro ao processar evento: {str(e)}')
                 system_state['stats']['failed_messages'] += 1
                 continue
         
+        # Estágio de envio: mensagens em paralelo, resultados gravados na thread do ciclo
+        def registrar_resultado(envio, enviado):
+            nonlocal mensagens_enviadas
+            protocolo = envio['protocolo']
+            situacao_codigo = envio['situacao_codigo']
+            escritor.registrar_situacao(protocolo, situacao_codigo, envio['situacao_nome'])
+            
+            if enviado:
+                mensagens_enviadas += 1
+                progresso['enviados'] += 1
+                system_state['stats']['successful_messages'] += 1
+                
+                # CORREÇÃO #4: Marcar como notificada
+                escritor.marcar_notificada(protocolo, situacao_codigo, 'ENVIADO')
+            else:
+                progresso['falhas'] += 1
+                system_state['stats']['failed_messages'] += 1
+                escritor.marcar_notificada(protocolo, situacao_codigo, 'FALHOU')
+                
+                # A outbox reenvia depois, fora do ciclo de eventos
+                escritor.enfileirar_reenvio(
+                    protocolo, situacao_codigo, envio['situacao_nome'], envio['telefone'],
+                    envio['mensagem'], envio['nome_associado'], envio['placa'],
+                    atraso_segundos=config.get('reenvio_intervalo_base_s', 60)
+                )
+            
+            escritor.salvar_mensagem(
+                protocolo, f"{protocolo}_{situacao_codigo}", situacao_codigo, envio['situacao_nome'],
+                envio['telefone'], envio['mensagem'],
+                'ENVIADO' if enviado else 'FALHOU', None if enviado else 'Erro no envio',
+                envio['nome_associado'], envio['placa']
+            )
+        
+        if envios:
+            system_state['current_step'] = f'Enviando {len(envios)} mensagens...'
+            despachar_mensagens(
+                uppchannel, envios, registrar_resultado,
+                max_concorrencia=config.get('envio_concorrencia', 4),
+                apos_lote=escritor.descarregar
+            )
+        
+        # Sem os resultados gravados, a marca d'água não pode avançar
+        if not escritor.descarregar_com_tentativas():
+            raise RuntimeError('Falha ao gravar os resultados do ciclo no banco')
+        
+        # Só avança a marca d'água se todas as requisições da busca deram certo
+        if hinova.ultima_listagem_completa:
+            registrar_busca_concluida(eventos, varredura_completa)
+        
         # Resumo final
         add_log('INFO', '=' * 60)
         add_log('INFO', f'📊 RESUMO DO PROCESSAMENTO:')
@@ -1101,13 +2636,86 @@ def processar_eventos():
         system_state['last_status'] = f"❌ Erro: {str(e)}"
         system_state['stats']['last_error'] = str(e)
         add_log('ERROR', f'❌ Erro no processamento: {str(e)}')
+        job['status'] = 'erro'
     
     finally:
+        if not escritor.descarregar_com_tentativas():
+            erro = f'Falha ao gravar {escritor.pendentes()} escritas pendentes do ciclo'
+            system_state['last_status'] = f"❌ Erro: {erro}"
+            system_state['stats']['last_error'] = erro
+            add_log('ERROR', f'❌ {erro}')
+            job['status'] = 'erro'
         system_state['is_running'] = False
         system_state['current_step'] = ''
+        with jobs_lock:
+            if job['status'] != 'erro':
+                job['status'] = 'concluido'
+            job['resultado'] = system_state['last_status']
+            job['concluido_em'] = datetime.now().isoformat()
         add_log('INFO', '=' * 60)
 
 
+def processar_outbox(limite=50):
+    """Reenvia as notificações pendentes da outbox
+    
+    Roda como job próprio do agendador, independente de processar_eventos,
+    então os reenvios nunca atrasam o ciclo de busca na Hinova. Cada item
+    é reservado antes do envio e o resultado é gravado com novas
+    tentativas, para uma falha do banco não virar envio em dobro.
+    """
+    if not outbox_lock.acquire(blocking=False):
+        return
+    
+    try:
+        pendentes = buscar_reenvios_pendentes(limite)
+        if not pendentes:
+            return
+        
+        config = carregar_configuracao()
+        if not config['uppchannel']['api_key']:
+            return
+        
+        add_log('INFO', f'🔁 Reenviando {len(pendentes)} notificações pendentes da outbox...')
+        uppchannel = UppChannelAPI(config['uppchannel']['api_key'])
+        resultado = {'ENVIADO': 0, 'PENDENTE': 0, 'MORTO': 0}
+        
+        intervalo_maximo = config.get('reenvio_intervalo_max_s', 3600)
+        for item in pendentes:
+            if not reservar_reenvio(item, intervalo_maximo):
+                continue
+            
+            enviado = uppchannel.enviar_mensagem(item['telefone'], item['mensagem'])
+            for tentativa in range(3):
+                status = registrar_tentativa_reenvio(
+                    item, enviado,
+                    max_tentativas=config.get('reenvio_max_tentativas', 5),
+                    intervalo_base=config.get('reenvio_intervalo_base_s', 60),
+                    intervalo_maximo=intervalo_maximo
+                )
+                if status:
+                    break
+                time.sleep(0.5 * 2 ** tentativa)
+            else:
+                add_log('ERROR', f'❌ Protocolo {item["protocolo"]}: resultado do reenvio não gravado, '
+                                 f'item reservado por {intervalo_maximo}s')
+            
+            if status:
+                resultado[status] += 1
+            if status == 'ENVIADO':
+                system_state['stats']['successful_messages'] += 1
+            elif status == 'MORTO':
+                add_log('ERROR', f'💀 Protocolo {item["protocolo"]}: reenvio desistido após {item["tentativas"] + 1} tentativas')
+        
+        add_log('INFO', f'🔁 Outbox: {resultado["ENVIADO"]} reenviadas, {resultado["PENDENTE"]} reagendadas, '
+                        f'{resultado["MORTO"]} sem mais tentativas')
+    
+    except Exception as e:
+        add_log('ERROR', f'❌ Erro ao processar outbox: {str(e)}')
+    
+    finally:
+        outbox_lock.release()
+
+
 # ==================== ROTAS FLASK ====================
 # (Mantidas as mesmas rotas do código original)
 
@@ -1182,6 +2790,8 @@ def index():
         .form-group input, .form-group textarea { width: 100%; padding: 12px; border: 2px solid #e0e0e0; border-radius: 8px; font-size: 14px; }
         .form-group input:focus, .form-group textarea:focus { outline: none; border-color: #667eea; }
         .table-container { background: white; border-radius: 12px; box-shadow: 0 2px 10px rgba(0,0,0,0.08); overflow: hidden; }
+        .filters { display: flex; flex-wrap: wrap; gap: 10px; margin-bottom: 20px; }
+        .filters input, .filters select { padding: 10px; border: 2px solid #e0e0e0; border-radius: 8px; font-size: 13px; }
     </style>
 </head>
 <body>
@@ -1207,6 +2817,7 @@ def index():
                     <div class="stat-card"><div class="stat-label">Enviadas</div><div class="stat-value" id="successMessages">0</div></div>
                     <div class="stat-card"><div class="stat-label">Falhas</div><div class="stat-value" id="failedMessages" style="color: #e74c3c;">0</div></div>
                     <div class="stat-card"><div class="stat-label">Processados</div><div class="stat-value" id="processedEvents">0</div></div>
+                    <div class="stat-card"><div class="stat-label">Reenvios pendentes</div><div class="stat-value" id="retryBacklog" style="color: #f39c12;">0</div><div class="stat-label" id="retryDetails" style="margin:8px 0 0 0;font-size:12px;">-</div></div>
                 </div>
                 <div class="log-panel">
                     <div class="log-header"><div class="log-title"><span class="status-indicator" id="statusIndicator"></span><span id="currentStep">Sistema aguardando...</span></div><button class="btn" onclick="updateStatus()" style="padding: 8px 16px; font-size: 12px;">🔄</button></div>
@@ -1224,8 +2835,10 @@ def index():
                 <div class="log-panel"><div class="log-header"><div class="log-title">Histórico</div></div><div class="log-body" id="fullLogContainer" style="height:600px;"><div class="loading"><div class="spinner"></div>Carregando...</div></div></div>
             </div>
             <div class="page" id="messages-page">
-                <div class="header"><h1>Mensagens</h1><button class="btn" onclick="refreshMessages()">🔄</button></div>
+                <div class="header"><h1>Mensagens</h1><div><button class="btn" onclick="exportMessages()">⬇️ CSV</button> <button class="btn" onclick="refreshMessages()">🔄</button></div></div>
+                <div class="filters"><select id="filtroStatus" onchange="refreshMessages()"><option value="">Todos os status</option><option>ENVIADO</option><option>FALHOU</option><option>ERRO</option></select><input type="text" id="filtroProtocolo" placeholder="Protocolo" onchange="refreshMessages()"><input type="text" id="filtroPlaca" placeholder="Placa" onchange="refreshMessages()"><input type="number" id="filtroSituacao" placeholder="Cód. situação" onchange="refreshMessages()"><input type="date" id="filtroInicio" onchange="refreshMessages()"><input type="date" id="filtroFim" onchange="refreshMessages()"></div>
                 <div class="table-container"><table><thead><tr><th>Data</th><th>Protocolo</th><th>Situação</th><th>Cliente</th><th>Status</th></tr></thead><tbody id="messagesTableBody"><tr><td colspan="5" style="text-align:center;padding:40px;"><div class="spinner"></div>Carregando...</td></tr></tbody></table></div>
+                <div id="messagesSentinel" style="text-align:center;padding:20px;color:#888;"></div>
             </div>
             <div class="page" id="config-page">
                 <div class="header"><h1>Configurações</h1><button class="btn btn-success" onclick="saveConfig()">💾 Salvar</button></div>
@@ -1237,16 +2850,26 @@ def index():
     </div>
     <script>
         let updateInterval;
+        let lastSeq=0;
         function showPage(p){document.querySelectorAll('.page').forEach(x=>x.classList.remove('active'));document.querySelectorAll('.nav-item').forEach(x=>x.classList.remove('active'));document.getElementById(p+'-page').classList.add('active');event.target.closest('.nav-item').classList.add('active');if(p==='messages')refreshMessages();else if(p==='logs')refreshFullLogs();else if(p==='config')loadConfig();}
-        async function updateStatus(){try{const r=await fetch('/api/status');const d=await r.json();document.getElementById('totalRuns').textContent=d.stats.total_runs;document.getElementById('successMessages').textContent=d.stats.successful_messages;document.getElementById('failedMessages').textContent=d.stats.failed_messages;document.getElementById('processedEvents').textContent=d.processed_events_count;const si=document.getElementById('statusIndicator');const cs=document.getElementById('currentStep');const ss=document.getElementById('systemStatus');if(d.is_running){si.className='status-indicator status-running';cs.textContent=d.current_step||'Processando...';ss.textContent='Rodando';}else{si.className='status-indicator status-idle';cs.textContent=d.last_status||'Ocioso';ss.textContent='Ocioso';}updateLogs(d.logs);document.getElementById('lastUpdate').textContent=new Date().toLocaleTimeString('pt-BR');}catch(e){console.error(e);}}
-        function updateLogs(logs){const c=document.getElementById('logContainer');c.innerHTML='';if(!logs||logs.length===0){c.innerHTML='<div style="color:#888;text-align:center;padding:20px;">Nenhum log</div>';return;}logs.forEach(l=>{const e=document.createElement('div');e.className='log-entry';e.innerHTML=`<span class="log-timestamp">${l.timestamp}</span><span class="log-level ${l.level}">${l.level}</span><span class="log-message">${l.message}</span>`;c.appendChild(e);});}
+        let st={stats:{},outbox:null};
+        function renderStatus(d){st=Object.assign(st,d,{stats:Object.assign(st.stats||{},d.stats||{}),outbox:d.outbox?Object.assign(st.outbox||{},d.outbox):st.outbox});const s=st.stats;document.getElementById('totalRuns').textContent=s.total_runs??0;document.getElementById('successMessages').textContent=s.successful_messages??0;document.getElementById('failedMessages').textContent=s.failed_messages??0;document.getElementById('processedEvents').textContent=st.processed_events_count??0;if(st.outbox){document.getElementById('retryBacklog').textContent=st.outbox.pendentes||0;document.getElementById('retryDetails').textContent='Mais antigo: '+(st.outbox.pendente_mais_antigo_em?Math.max(0,Math.round((Date.now()-Date.parse(st.outbox.pendente_mais_antigo_em))/1000)):0)+'s · Latência média: '+(st.outbox.latencia_media_reenvio_s??'-')+'s · Desistidos: '+(st.outbox.mortos||0);}const si=document.getElementById('statusIndicator');const cs=document.getElementById('currentStep');const ss=document.getElementById('systemStatus');if(st.is_running){si.className='status-indicator status-running';cs.textContent=st.current_step||'Processando...';ss.textContent='Rodando';}else{si.className='status-indicator status-idle';cs.textContent=st.last_status||'Ocioso';ss.textContent='Ocioso';}document.getElementById('lastUpdate').textContent=new Date().toLocaleTimeString('pt-BR');}
+        function addLogs(logs,seq){if(seq<lastSeq)lastSeq=0;updateLogs(logs);lastSeq=Math.max(lastSeq,seq||0,...logs.map(l=>l.seq));}
+        async function updateStatus(){try{const r=await fetch('/api/status'+(lastSeq?'?since='+lastSeq:''));const d=await r.json();renderStatus(d);addLogs(d.logs,d.last_seq);}catch(e){console.error(e);}}
+        function startPolling(){if(!updateInterval){updateStatus();updateInterval=setInterval(updateStatus,5000);}}
+        function startStream(){if(!window.EventSource){startPolling();return;}let falhas=0;const es=new EventSource('/api/stream'+(lastSeq?'?since='+lastSeq:''));es.addEventListener('status',e=>{falhas=0;renderStatus(JSON.parse(e.data));});es.addEventListener('logs',e=>{falhas=0;addLogs(JSON.parse(e.data),parseInt(e.lastEventId));});es.onerror=()=>{if(es.readyState===EventSource.CLOSED||++falhas>=3){es.close();startPolling();}};}
+        function updateLogs(logs){const c=document.getElementById('logContainer');if(!lastSeq)c.innerHTML='';if(!logs||logs.length===0){if(!c.children.length)c.innerHTML='<div class="log-empty" style="color:#888;text-align:center;padding:20px;">Nenhum log</div>';return;}const v=c.querySelector('.log-empty');if(v)v.remove();const f=document.createDocumentFragment();logs.forEach(l=>{const e=document.createElement('div');e.className='log-entry';e.innerHTML=`<span class="log-timestamp">${l.timestamp}</span><span class="log-level ${l.level}">${l.level}</span><span class="log-message">${l.message}</span>`;f.appendChild(e);});c.insertBefore(f,c.firstChild);while(c.children.length>50)c.removeChild(c.lastChild);}
         async function refreshFullLogs(){const c=document.getElementById('fullLogContainer');c.innerHTML='<div class="loading"><div class="spinner"></div>Carregando...</div>';try{const r=await fetch('/api/logs');const logs=await r.json();c.innerHTML='';logs.forEach(l=>{const e=document.createElement('div');e.className='log-entry';e.innerHTML=`<span class="log-timestamp">${l.timestamp}</span><span class="log-level ${l.level}">${l.level}</span><span class="log-message">${l.message}</span>`;c.appendChild(e);});}catch(e){c.innerHTML='<div style="color:#e74c3c;text-align:center;padding:20px;">Erro</div>';}}
-        async function refreshMessages(){const t=document.getElementById('messagesTableBody');t.innerHTML='<tr><td colspan="5" style="text-align:center;padding:40px;"><div class="spinner"></div>Carregando...</td></tr>';try{const r=await fetch('/api/messages');const m=await r.json();t.innerHTML='';if(m.length===0){t.innerHTML='<tr><td colspan="5" style="text-align:center;padding:40px;color:#888;">Nenhuma mensagem</td></tr>';return;}m.forEach(msg=>{const row=document.createElement('tr');row.innerHTML=`<td>${msg.timestamp}</td><td>${msg.protocolo}</td><td>${msg.situacao}</td><td>${msg.cliente}</td><td><span class="badge ${msg.status==='success'?'badge-success':'badge-error'}">${msg.status}</span></td>`;t.appendChild(row);});}catch(e){t.innerHTML='<tr><td colspan="5" style="text-align:center;padding:40px;color:#e74c3c;">Erro</td></tr>';}}
+        let msgCursor=null,msgFim=false,msgCarregando=false,msgObserver=null,msgGeracao=0;
+        function filtrosMensagens(){const p=new URLSearchParams();[['status','filtroStatus'],['protocolo','filtroProtocolo'],['placa','filtroPlaca'],['situacao_codigo','filtroSituacao'],['data_inicio','filtroInicio'],['data_fim','filtroFim']].forEach(([k,id])=>{const v=document.getElementById(id).value.trim();if(v)p.set(k,v);});return p;}
+        async function loadMoreMessages(){if(msgCarregando||msgFim)return;msgCarregando=true;const g=msgGeracao;const t=document.getElementById('messagesTableBody');const sn=document.getElementById('messagesSentinel');sn.textContent='Carregando...';try{const p=filtrosMensagens();p.set('limit','100');if(msgCursor!==null)p.set('before_id',msgCursor);const r=await fetch('/api/messages?'+p);if(!r.ok)throw new Error(r.status);const m=await r.json();if(g!==msgGeracao)return;if(msgCursor===null)t.innerHTML='';if(m.length===0&&msgCursor===null)t.innerHTML='<tr><td colspan="5" style="text-align:center;padding:40px;color:#888;">Nenhuma mensagem</td></tr>';const f=document.createDocumentFragment();m.forEach(msg=>{const row=document.createElement('tr');row.innerHTML=`<td>${new Date(msg.timestamp).toLocaleString('pt-BR')}</td><td>${msg.protocolo??''}</td><td>${msg.situacao_nome??''}</td><td>${msg.nome_associado??''}</td><td><span class="badge ${msg.status==='ENVIADO'?'badge-success':'badge-error'}">${msg.status}</span></td>`;f.appendChild(row);});t.appendChild(f);if(m.length)msgCursor=m[m.length-1].id;msgFim=m.length<100;sn.textContent=msgFim?(msgCursor===null?'':'Fim do histórico'):'';}catch(e){if(g!==msgGeracao)return;if(msgCursor===null)t.innerHTML='<tr><td colspan="5" style="text-align:center;padding:40px;color:#e74c3c;">Erro</td></tr>';sn.textContent='';}finally{if(g===msgGeracao)msgCarregando=false;}}
+        function exportMessages(){const p=filtrosMensagens();p.set('formato','csv');window.location='/api/export/messages?'+p;}
+        function refreshMessages(){msgGeracao++;msgCarregando=false;msgCursor=null;msgFim=false;document.getElementById('messagesTableBody').innerHTML='<tr><td colspan="5" style="text-align:center;padding:40px;"><div class="spinner"></div>Carregando...</td></tr>';if(!msgObserver&&window.IntersectionObserver){msgObserver=new IntersectionObserver(es=>{if(es[0].isIntersecting&&msgCursor!==null)loadMoreMessages();});msgObserver.observe(document.getElementById('messagesSentinel'));}loadMoreMessages();}
         async function loadConfig(){try{const r=await fetch('/api/config');const c=await r.json();document.getElementById('configHinovaToken').value=c.hinova.token||'';document.getElementById('configHinovaUser').value=c.hinova.usuario||'';document.getElementById('configHinovaPass').value=c.hinova.senha||'';document.getElementById('configUppKey').value=c.uppchannel.api_key||'';document.getElementById('configInterval').value=c.intervalo_minutos||15;document.getElementById('configSituacoes').value=c.situacoes_ativas.join(',');}catch(e){console.error(e);}}
         async function saveConfig(){const c={hinova:{token:document.getElementById('configHinovaToken').value,usuario:document.getElementById('configHinovaUser').value,senha:document.getElementById('configHinovaPass').value},uppchannel:{api_key:document.getElementById('configUppKey').value},intervalo_minutos:parseInt(document.getElementById('configInterval').value),situacoes_ativas:document.getElementById('configSituacoes').value.split(',').map(x=>parseInt(x.trim()))};try{const r=await fetch('/api/config',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(c)});if(r.ok)alert('✅ Salvo!');else alert('❌ Erro');}catch(e){alert('❌ Erro: '+e.message);}}
-        async function runNow(){if(confirm('Executar agora?')){try{await fetch('/api/run-now');alert('✓ Iniciado! Veja os logs.');}catch(e){alert('Erro');}}}
+        async function runNow(){if(confirm('Executar agora?')){try{const r=await fetch('/api/run-now');const d=await r.json();alert((d.status==='coalesced'?'ℹ️ Já em execução':'✓ Iniciado!')+' Job '+d.job_id+'. Veja os logs.');}catch(e){alert('Erro');}}}
         async function testConnections(){const r=document.getElementById('testResults');r.innerHTML='<div class="loading"><div class="spinner"></div>Testando...</div>';try{const res=await fetch('/api/test-connections');const d=await res.json();let h='';h+='<div style="margin-bottom:20px;padding:20px;background:'+(d.hinova.status==='success'?'#d4edda':'#f8d7da')+';border-radius:10px;border-left:5px solid '+(d.hinova.status==='success'?'#28a745':'#dc3545')+';">'; h+='<h3 style="margin:0 0 10px 0;color:'+(d.hinova.status==='success'?'#155724':'#721c24')+';">'+( d.hinova.status==='success'?'✅':'❌')+' Hinova</h3><p><strong>Status:</strong> '+d.hinova.message+'</p>';if(d.hinova.details&&d.hinova.details.token_cached)h+='<p><strong>Token:</strong> '+d.hinova.details.token_cached+'</p>';h+='</div>';h+='<div style="padding:20px;background:'+(d.uppchannel.status==='success'?'#d4edda':'#f8d7da')+';border-radius:10px;border-left:5px solid '+(d.uppchannel.status==='success'?'#28a745':'#dc3545')+';">'; h+='<h3 style="margin:0 0 10px 0;color:'+(d.uppchannel.status==='success'?'#155724':'#721c24')+';">'+( d.uppchannel.status==='success'?'✅':'❌')+' UppChannel</h3><p><strong>Status:</strong> '+d.uppchannel.message+'</p></div>';r.innerHTML=h;}catch(e){r.innerHTML='<div style="color:#e74c3c;text-align:center;padding:40px;">❌ Erro</div>';}}
-        updateStatus();updateInterval=setInterval(updateStatus,5000);
+        startStream();
     </script>
 </body>
 </html>'''
@@ -1268,7 +2891,7 @@ def debug_eventos():
         
         # Buscar eventos de hoje
         hoje = datetime.now().strftime('%Y-%m-%d')
-        eventos = hinova.listar_eventos(hoje, hoje)
+        eventos = hinova.listar_eventos(hoje, hoje, compactar=False)
         
         resultado = {
             'total_eventos': len(eventos),
@@ -1304,48 +2927,271 @@ def debug_eventos():
         import traceback
         return jsonify({'erro': str(e), 'traceback': traceback.format_exc()})
 
-@app.route('/api/status')
-def api_status():
-    """Status do sistema em JSON"""
-    return jsonify({
+def resposta_condicional(gerar_corpo):
+    """JSON com ETag da versão do estado; 304 sem corpo se o cliente já a tem
+    
+    A versão é lida antes de montar o corpo: no pior caso o cliente recebe
+    um corpo mais novo que o ETag e o busca de novo na próxima consulta.
+    """
+    etag = f'{avisos.instancia}-{avisos.versao}'
+    if request.if_none_match.contains(etag):
+        resposta = Response(status=304)
+    else:
+        resposta = jsonify(gerar_corpo())
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta
+
+def estado_publico():
+    """Estado do sistema exposto por /api/status e /api/stream (sem os logs)"""
+    return {
         'last_run': system_state['last_run'].isoformat() if system_state['last_run'] else None,
         'last_status': system_state['last_status'],
         'is_running': system_state['is_running'],
         'current_step': system_state['current_step'],
-        'stats': system_state['stats'],
-        'logs': system_state['logs'][:50],
+        'stats': dict(system_state['stats']),
+        'log_writer': gravador_logs.estatisticas(),
+        'rate_limiter': limitador_uppchannel.estatisticas(),
+        'outbox': estatisticas_outbox(),
         'processed_events_count': len(system_state['processed_events'])
+    }
+
+class FotoEstado:
+    """estado_publico() calculado uma vez por versão e compartilhado
+    
+    Com vários streams abertos, cada aviso acordaria todos eles e cada um
+    refaria as consultas de estatísticas da outbox; aqui o primeiro a pedir
+    uma versão nova monta o estado e os demais reaproveitam. O dict
+    devolvido é somente leitura.
+    """
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._versao = None
+        self._estado = None
+    
+    def obter(self):
+        versao = avisos.versao
+        with self._lock:
+            if self._versao != versao:
+                self._estado = estado_publico()
+                self._versao = versao
+            return self._estado
+
+
+foto_estado = FotoEstado()
+
+def diferenca_estado(anterior, atual):
+    """Só as chaves que mudaram (um nível dentro de dicionários como 'stats')"""
+    delta = {}
+    for chave, valor in atual.items():
+        if isinstance(valor, dict) and isinstance(anterior.get(chave), dict):
+            sub = {k: v for k, v in valor.items() if anterior[chave].get(k) != v}
+            if sub:
+                delta[chave] = sub
+        elif chave not in anterior or anterior[chave] != valor:
+            delta[chave] = valor
+    return delta
+
+@app.route('/api/status')
+def api_status():
+    """Status do sistema em JSON (?since=N traz apenas os logs após a sequência N)"""
+    def gerar():
+        # Lida antes dos logs: o cliente nunca pula uma entrada ao pedir "since"
+        ultimo_seq = system_state['logs'].ultimo_seq
+        estado = dict(foto_estado.obter())
+        estado['logs'] = system_state['logs'].recentes(50, desde=request.args.get('since', type=int))
+        estado['last_seq'] = ultimo_seq
+        return estado
+    
+    return resposta_condicional(gerar)
+
+# Duração máxima de cada conexão SSE; o navegador reconecta sozinho (Last-Event-ID)
+SSE_DURACAO_MAXIMA = int(os.getenv('SSE_DURACAO_MAXIMA', '300'))
+# Cada stream ocupa uma thread do worker enquanto está aberto; acima do
+# limite a resposta é 503 e o dashboard passa a consultar /api/status
+SSE_MAX_CONEXOES = max(0, int(os.getenv('SSE_MAX_CONEXOES', '4')))
+conexoes_sse = threading.BoundedSemaphore(SSE_MAX_CONEXOES) if SSE_MAX_CONEXOES else None
+
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events: novos logs (evento 'logs') e mudanças de estado (evento 'status')
+    
+    A primeira mensagem traz o estado completo e os últimos 50 logs (ou os
+    posteriores a ?since=N / Last-Event-ID); depois só o que mudou. Com
+    SSE_MAX_CONEXOES streams já abertos responde 503.
+    """
+    if conexoes_sse is None or not conexoes_sse.acquire(blocking=False):
+        resposta = jsonify({'error': 'Limite de conexões de stream atingido, use /api/status'})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = '30'
+        return resposta
+    
+    desde = request.headers.get('Last-Event-ID', type=int)
+    if desde is None:
+        desde = request.args.get('since', type=int)
+    
+    def gerar(desde):
+        inicio = time.monotonic()
+        anterior = {}
+        versao = None
+        primeiro = True
+        yield 'retry: 3000\n\n'
+        
+        while time.monotonic() - inicio < SSE_DURACAO_MAXIMA:
+            if not primeiro:
+                restante = SSE_DURACAO_MAXIMA - (time.monotonic() - inicio)
+                nova_versao = avisos.aguardar(versao, timeout=max(0, min(15, restante)))
+                if nova_versao == versao:
+                    yield ': ping\n\n'
+                    continue
+                # Junta rajadas de logs em uma só mensagem
+                time.sleep(0.25)
+            versao = avisos.versao
+            
+            ultimo_seq = system_state['logs'].ultimo_seq
+            logs = system_state['logs'].recentes(50, desde=desde)
+            if logs or primeiro:
+                desde = max([ultimo_seq] + [log['seq'] for log in logs])
+                yield f'id: {desde}\nevent: logs\ndata: {json.dumps(logs, ensure_ascii=False)}\n\n'
+            
+            atual = foto_estado.obter()
+            delta = diferenca_estado(anterior, atual)
+            anterior = atual
+            if delta:
+                yield f'event: status\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n'
+            
+            primeiro = False
+    
+    resposta = Response(stream_with_context(gerar(desde)), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
+    # Libera a vaga quando o servidor fecha a resposta, mesmo se o gerador nem começou
+    resposta.call_on_close(conexoes_sse.release)
+    return resposta
 
 @app.route('/api/logs')
 def api_logs():
-    """Logs do sistema"""
-    return jsonify(system_state['logs'])
+    """Logs do sistema (?since=N retorna apenas as entradas após a sequência N)"""
+    return resposta_condicional(lambda: system_state['logs'].recentes(desde=request.args.get('since', type=int)))
 
 @app.route('/api/messages')
 def api_messages():
-    """Histórico de mensagens"""
+    """Histórico de mensagens
+    
+    ?limit=N (até 500), cursor ?before_id=ID / ?after_id=ID e filtros
+    status, protocolo, situacao_codigo, placa, data_inicio, data_fim.
+    """
     limit = request.args.get('limit', 100, type=int)
-    return jsonify(get_messages_history(limit))
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    try:
+        filtros = ler_filtros_mensagens(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return resposta_condicional(lambda: get_messages_history(limit, before_id, after_id, filtros))
+
+@app.route('/api/export/<tabela>')
+def api_export(tabela):
+    """Exportação em streaming de messages ou evento_historico
+    
+    ?formato=csv|ndjson, ?gzip=1 e os mesmos filtros de /api/messages
+    (em evento_historico: status = status_notificacao e datas sobre
+    data_deteccao; placa não se aplica).
+    """
+    if tabela not in EXPORTACOES:
+        return jsonify({'error': f'Tabela não exportável: {tabela}'}), 404
+    
+    formato = request.args.get('formato', 'csv')
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({'error': 'Formato inválido (use csv ou ndjson)'}), 400
+    try:
+        filtros = ler_filtros_mensagens(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    blocos = exportar_tabela(tabela, filtros, formato)
+    nome_arquivo = f"{tabela}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    mimetype = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    
+    if request.args.get('gzip') in ('1', 'true'):
+        blocos = comprimir_gzip(blocos)
+        nome_arquivo += '.gz'
+        mimetype = 'application/gzip'
+    
+    add_log('INFO', f'📤 Exportação de {tabela} ({formato}) iniciada')
+    return Response(stream_with_context(blocos), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={nome_arquivo}'
+    })
 
 @app.route('/api/run-now')
 def run_now():
-    """Executa processamento manual"""
-    add_log('INFO', '▶️ Execução manual iniciada')
-    processar_eventos()
-    return jsonify({'status': 'completed', 'message': system_state['last_status']})
+    """Dispara processamento manual em segundo plano e retorna o ID do job"""
+    job, novo = iniciar_execucao('manual')
+    if novo:
+        add_log('INFO', f'▶️ Execução manual iniciada (job {job["id"]})')
+    else:
+        add_log('INFO', f'▶️ Execução manual unida ao job em andamento ({job["id"]})')
+    
+    return jsonify({
+        'status': 'queued' if novo else 'coalesced',
+        'job_id': job['id'],
+        'job_url': f'/api/jobs/{job["id"]}',
+        'message': 'Execução iniciada' if novo else 'Já existe uma execução em andamento'
+    }), 202
+
+@app.route('/api/jobs')
+def api_jobs():
+    """Execuções recentes, mais novas primeiro"""
+    with jobs_lock:
+        ids = list(jobs_estado['recentes'])
+    return jsonify([job for job in (consultar_job(job_id) for job_id in reversed(ids)) if job])
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """Progresso de uma execução"""
+    job = consultar_job(job_id)
+    if job is None:
+        return jsonify({'erro': 'Job não encontrado'}), 404
+    return jsonify(job)
 
 @app.route('/api/config', methods=['GET', 'POST'])
 def api_config():
     """Gerenciar configuração"""
     if request.method == 'POST':
         config = request.json
-        save_config('main_config', config)
-        add_log('SUCCESS', '✓ Configuração atualizada')
-        return jsonify({'status': 'success'})
+        if not isinstance(config, dict):
+            return jsonify({'error': 'Configuração inválida'}), 400
+        _, erros = compilar_templates(config.get('templates_mensagem') or {})
+        if erros:
+            return jsonify({'error': 'Templates inválidos', 'details': erros}), 400
+        intervalo = config.get('intervalo_minutos')
+        if intervalo is not None and (not isinstance(intervalo, int) or intervalo < 1):
+            return jsonify({'error': 'intervalo_minutos deve ser um inteiro >= 1'}), 400
+        
+        # POSTs simultâneos: cada um grava, recarrega e reagenda sem se intercalar
+        with configuracao.escrita():
+            intervalo_anterior = carregar_configuracao().get('intervalo_minutos')
+            save_config('main_config', config)
+            nova = configuracao.recarregar()
+            versao = configuracao.versao
+            add_log('SUCCESS', f'✓ Configuração atualizada (versão {versao})')
+            
+            if nova.get('intervalo_minutos') != intervalo_anterior:
+                reagendar_processamento(nova['intervalo_minutos'])
+        return jsonify({'status': 'success', 'version': versao})
     else:
-        config = carregar_configuracao()
-        return jsonify(config)
+        resposta = jsonify(carregar_configuracao())
+        resposta.headers['X-Config-Version'] = str(configuracao.versao)
+        return resposta
+
+def reagendar_processamento(intervalo):
+    """Aplica um novo intervalo ao job de processamento sem reiniciar"""
+    if not intervalo or scheduler.get_job('processar_eventos') is None:
+        return
+    scheduler.reschedule_job('processar_eventos', trigger=IntervalTrigger(minutes=intervalo))
+    add_log('INFO', f'⏱️ Intervalo alterado para {intervalo} minutos')
 
 @app.route('/api/test-connections')
 def test_connections():
@@ -1407,9 +3253,25 @@ def test_connections():
 # ==================== INICIALIZAÇÃO ====================
 
 scheduler = BackgroundScheduler()
+inicializacao_lock = Lock()
+sistema_iniciado = False
 
-if __name__ == '__main__':
-    # Inicializar banco
+def iniciar_sistema():
+    """Banco, agendador e backups, uma única vez por processo
+    
+    Chamada pelo __main__ (python app.py) e pelo hook post_worker_init do
+    gunicorn.conf.py, já que o gunicorn importa app:app sem passar pelo
+    __main__. O processamento inicial roda em segundo plano pelo agendador
+    para não segurar a subida do worker.
+    """
+    global sistema_iniciado
+    with inicializacao_lock:
+        if sistema_iniciado:
+            return
+        sistema_iniciado = True
+    
+    # Inicializar banco (restaurando o último backup se o arquivo sumiu)
+    restaurar_backup_no_boot()
     init_database()
     
     add_log('INFO', '🚀 Sistema CORRIGIDO iniciando...')
@@ -1435,12 +3297,42 @@ if __name__ == '__main__':
         replace_existing=True
     )
     
-    scheduler.start()
-    add_log('SUCCESS', '✓ Agendador iniciado')
+    # Reenvios da outbox em job separado
+    scheduler.add_job(
+        func=processar_outbox,
+        trigger=IntervalTrigger(minutes=1),
+        id='processar_outbox',
+        name='Reenviar notificações pendentes',
+        replace_existing=True
+    )
+    
+    if BACKUP_DIR:
+        scheduler.add_job(
+            func=fazer_backup,
+            trigger=IntervalTrigger(minutes=BACKUP_INTERVALO_MINUTOS),
+            id='backup_banco',
+            name='Backup do banco',
+            replace_existing=True
+        )
+        # Backup final no desligamento para não perder o último ciclo
+        atexit.register(fazer_backup)
+        add_log('INFO', f'💾 Backups a cada {BACKUP_INTERVALO_MINUTOS} min em {BACKUP_DIR}')
     
     # Executar uma vez ao iniciar
     add_log('INFO', '▶️ Executando processamento inicial...')
-    processar_eventos()
+    scheduler.add_job(
+        func=processar_eventos,
+        id='processamento_inicial',
+        name='Processamento inicial',
+        replace_existing=True
+    )
+    
+    scheduler.start()
+    add_log('SUCCESS', '✓ Agendador iniciado')
+
+
+if __name__ == '__main__':
+    iniciar_sistema()
     
     # Iniciar Flask
     port = int(os.environ.get('PORT', 10000))
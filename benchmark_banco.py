@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark da camada SQLite: conexão por chamada x conexão persistente
+
+Simula o trabalho de banco feito por evento em processar_eventos
+(verificar histórico, última situação, registrar, marcar e salvar mensagem)
+e mostra a latência média por evento nos dois modelos.
+
+Uso: python benchmark_banco.py [quantidade_eventos]
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+import app
+
+N_EVENTOS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+def preparar_banco(caminho):
+    """Cria um banco novo com o schema da aplicação"""
+    app.db.reabrir(caminho)
+    app.init_database()
+
+
+def evento_por_chamada(caminho, protocolo, situacao):
+    """Modelo antigo: abre e fecha uma conexão em cada helper"""
+    conn = sqlite3.connect(caminho)
+    conn.execute('SELECT id, data_notificacao, status_notificacao FROM evento_historico '
+                 'WHERE protocolo = ? AND situacao_codigo = ?', (protocolo, situacao)).fetchone()
+    conn.close()
+
+    conn = sqlite3.connect(caminho)
+    conn.execute('SELECT situacao_codigo, situacao_nome, data_deteccao FROM evento_historico '
+                 'WHERE protocolo = ? ORDER BY data_deteccao DESC LIMIT 1', (protocolo,)).fetchone()
+    conn.close()
+
+    conn = sqlite3.connect(caminho)
+    conn.execute('INSERT OR IGNORE INTO evento_historico (protocolo, situacao_codigo, situacao_nome, data_deteccao) '
+                 'VALUES (?, ?, ?, ?)', (protocolo, situacao, 'ANÁLISE', datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(caminho)
+    conn.execute('UPDATE evento_historico SET data_notificacao = ?, status_notificacao = ? '
+                 'WHERE protocolo = ? AND situacao_codigo = ?',
+                 (datetime.now().isoformat(), 'ENVIADO', protocolo, situacao))
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(caminho)
+    conn.execute('INSERT INTO messages (timestamp, protocolo, evento_id, situacao_codigo, situacao_nome, '
+                 'telefone, mensagem, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                 (datetime.now().isoformat(), protocolo, f'{protocolo}_{situacao}', situacao,
+                  'ANÁLISE', '11999999999', 'teste', 'ENVIADO'))
+    conn.commit()
+    conn.close()
+
+
+def evento_persistente(protocolo, situacao):
+    """Modelo novo: as mesmas operações sobre a conexão persistente da thread"""
+    conn = app.db.conexao()
+    conn.execute('SELECT id, data_notificacao, status_notificacao FROM evento_historico '
+                 'WHERE protocolo = ? AND situacao_codigo = ?', (protocolo, situacao)).fetchone()
+    conn.execute('SELECT situacao_codigo, situacao_nome, data_deteccao FROM evento_historico '
+                 'WHERE protocolo = ? ORDER BY data_deteccao DESC LIMIT 1', (protocolo,)).fetchone()
+
+    with app.db_lock:
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO evento_historico (protocolo, situacao_codigo, situacao_nome, data_deteccao) '
+                         'VALUES (?, ?, ?, ?)', (protocolo, situacao, 'ANÁLISE', datetime.now().isoformat()))
+        with conn:
+            conn.execute('UPDATE evento_historico SET data_notificacao = ?, status_notificacao = ? '
+                         'WHERE protocolo = ? AND situacao_codigo = ?',
+                         (datetime.now().isoformat(), 'ENVIADO', protocolo, situacao))
+        with conn:
+            conn.execute('INSERT INTO messages (timestamp, protocolo, evento_id, situacao_codigo, situacao_nome, '
+                         'telefone, mensagem, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (datetime.now().isoformat(), protocolo, f'{protocolo}_{situacao}', situacao,
+                          'ANÁLISE', '11999999999', 'teste', 'ENVIADO'))
+
+
+def medir(nome, funcao):
+    inicio = time.perf_counter()
+    for i in range(N_EVENTOS):
+        funcao(f'P{i:07d}', 15)
+    total = time.perf_counter() - inicio
+    print(f'{nome:<28} total {total:8.3f}s   por evento {total / N_EVENTOS * 1e6:9.1f} µs')
+    return total
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho_antigo = os.path.join(tmp, 'por_chamada.db')
+        caminho_novo = os.path.join(tmp, 'persistente.db')
+
+        # O banco do modelo antigo volta ao journal padrão (sem WAL)
+        preparar_banco(caminho_antigo)
+        app.db.conexao().execute('PRAGMA journal_mode=DELETE')
+        app.db.fechar()
+        preparar_banco(caminho_novo)
+
+        print('=' * 70)
+        print(f'BENCHMARK SQLITE - {N_EVENTOS} eventos')
+        print('=' * 70)
+
+        t_antigo = medir('Conexão por chamada', lambda p, s: evento_por_chamada(caminho_antigo, p, s))
+        t_novo = medir('Conexão persistente (WAL)', evento_persistente)
+
+        print('-' * 70)
+        print(f'Ganho: {t_antigo / t_novo:.1f}x')
+        app.db.fechar()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark HTTP: requisição avulsa x sessão com keep-alive
+
+Sobe um servidor local que imita o endpoint de envio da UppChannel (HTTPS
+com certificado autoassinado quando o openssl está disponível) e mede o
+tempo por mensagem com requests.post avulso, que abre uma conexão e faz o
+handshake a cada chamada, e com UppChannelAPI sobre a sessão compartilhada.
+
+Uso: python benchmark_http.py [quantidade_mensagens]
+"""
+
+import json
+import logging
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import app
+
+N_MENSAGENS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Responde 200 a qualquer POST, mantendo a conexão aberta"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    conexoes = 0
+
+    def setup(self):
+        super().setup()
+        StubHandler.conexoes += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        corpo = json.dumps({'status': 'ok'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def gerar_certificado(pasta):
+    """Gera certificado autoassinado para localhost; None se não houver openssl"""
+    cert = os.path.join(pasta, 'cert.pem')
+    chave = os.path.join(pasta, 'key.pem')
+    try:
+        subprocess.run([
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+            '-keyout', chave, '-out', cert, '-subj', '/CN=localhost',
+            '-addext', 'subjectAltName=DNS:localhost'
+        ], check=True, capture_output=True)
+        return cert, chave
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def iniciar_servidor(pasta):
+    servidor = ThreadingHTTPServer(('localhost', 0), StubHandler)
+    servidor.daemon_threads = True
+    certificado = gerar_certificado(pasta)
+    esquema = 'http'
+    if certificado:
+        contexto = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        contexto.load_cert_chain(*certificado)
+        servidor.socket = contexto.wrap_socket(servidor.socket, server_side=True)
+        esquema = 'https'
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    url = f'{esquema}://localhost:{servidor.server_address[1]}/chat'
+    return servidor, url, certificado[0] if certificado else True
+
+
+def medir(nome, enviar):
+    StubHandler.conexoes = 0
+    inicio = time.perf_counter()
+    for i in range(N_MENSAGENS):
+        enviar(f'1199999{i:04d}', 'mensagem de teste')
+    total = time.perf_counter() - inicio
+    print(f'{nome:<26} total {total:7.3f}s   por mensagem {total / N_MENSAGENS * 1000:7.2f} ms'
+          f'   conexões {StubHandler.conexoes}')
+    return total
+
+
+if __name__ == '__main__':
+    logging.getLogger(app.__name__).setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.db.reabrir(os.path.join(tmp, 'bench.db'))
+        app.init_database()
+
+        servidor, base_url, verify = iniciar_servidor(tmp)
+
+        def avulso(telefone, mensagem):
+            requests.post(f'{base_url}/v1/message/send', json={'number': telefone, 'message': mensagem},
+                          headers={'apikey': 'teste'}, timeout=30, verify=verify).raise_for_status()
+
+        sessao = app.criar_sessao_http()
+        sessao.verify = verify
+        sessao.trust_env = False  # REQUESTS_CA_BUNDLE sobrescreveria o verify da sessão
+        # Sem limite de taxa: o benchmark mede só o custo das conexões
+        cliente = app.UppChannelAPI('teste', sessao=sessao, limitador=app.LimitadorTaxa(0, 0))
+        cliente.base_url = base_url
+
+        print('=' * 78)
+        print(f'BENCHMARK HTTP - {N_MENSAGENS} mensagens para {base_url}')
+        print('=' * 78)
+
+        t_avulso = medir('requests.post avulso', avulso)
+        t_sessao = medir('Sessão com keep-alive', cliente.enviar_mensagem)
+
+        print('-' * 78)
+        print(f'Economia por mensagem: {(t_avulso - t_sessao) / N_MENSAGENS * 1000:.2f} ms '
+              f'({t_avulso / t_sessao:.1f}x)')
+
+        servidor.shutdown()
+        app.gravador_logs.parar()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos índices do banco: schema antigo x schema migrado
+
+Cria um banco com o schema sem índices secundários (como os bancos
+anteriores às migrações), popula messages e evento_historico com
+N linhas cada, mede as consultas do dia a dia, aplica as migrações no
+lugar e mede de novo.
+
+Uso: python benchmark_indices.py [quantidade_linhas]
+"""
+
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import app
+
+N_LINHAS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPETICOES = 20
+SITUACOES_POR_PROTOCOLO = 5
+
+
+def criar_banco_antigo(caminho):
+    """Schema da aplicação sem os índices das migrações (user_version 0)"""
+    app.db.reabrir(caminho)
+    app.init_database()
+    conn = app.db.conexao()
+    for (nome,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'").fetchall():
+        conn.execute(f'DROP INDEX {nome}')
+    conn.execute('PRAGMA user_version = 0')
+    conn.commit()
+
+
+def popular(n):
+    conn = app.db.conexao()
+    inicio = datetime.now() - timedelta(days=180)
+    passo = timedelta(days=180) / n
+    status = ('ENVIADO',) * 8 + ('FALHOU', 'ERRO')
+
+    def mensagens():
+        for i in range(n):
+            protocolo = f'P{i % (n // SITUACOES_POR_PROTOCOLO):07d}'
+            yield ((inicio + passo * i).isoformat(), protocolo, f'{protocolo}_{i % 15}', i % 15, 'ANÁLISE',
+                   '11999999999', 'mensagem de teste', status[i % len(status)], None, 'ASSOCIADO', f'ABC{i % 9999:04d}')
+
+    def historico():
+        for i in range(n):
+            yield (f'P{i // SITUACOES_POR_PROTOCOLO:07d}', i % SITUACOES_POR_PROTOCOLO, 'ANÁLISE',
+                   (inicio + passo * i).isoformat())
+
+    with conn:
+        conn.executemany('''
+            INSERT INTO messages (timestamp, protocolo, evento_id, situacao_codigo, situacao_nome,
+                                  telefone, mensagem, status, erro, nome_associado, placa)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', mensagens())
+        conn.executemany('''
+            INSERT INTO evento_historico (protocolo, situacao_codigo, situacao_nome, data_deteccao)
+            VALUES (?, ?, ?, ?)
+        ''', historico())
+    conn.execute('ANALYZE')
+
+
+def ultima_situacao(protocolo):
+    """Última situação de um protocolo (o ORDER BY usa o índice da migração 2)"""
+    return app.db.conexao().execute('''
+        SELECT situacao_codigo, situacao_nome, data_deteccao
+        FROM evento_historico
+        WHERE protocolo = ?
+        ORDER BY data_deteccao DESC
+        LIMIT 1
+    ''', (protocolo,)).fetchone()
+
+
+def consultas(n):
+    """Consultas medidas: nome -> função sem argumentos"""
+    protocolos = n // SITUACOES_POR_PROTOCOLO
+    dia = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
+    meio = n // 2
+    return {
+        'última situação': lambda: ultima_situacao(f'P{random.randrange(protocolos):07d}'),
+        'mensagens por protocolo': lambda: app.get_messages_history(
+            100, filtros={'protocolo': f'P{random.randrange(protocolos):07d}'}),
+        'FALHOU, 1ª página': lambda: app.get_messages_history(100, filtros={'status': 'FALHOU'}),
+        'FALHOU, página no meio': lambda: app.get_messages_history(
+            100, before_id=meio, filtros={'status': 'FALHOU'}),
+        'mensagens de um dia': lambda: app.get_messages_history(
+            100, filtros={'data_inicio': dia, 'data_fim': dia}),
+    }
+
+
+def medir(funcoes):
+    resultados = {}
+    for nome, funcao in funcoes.items():
+        inicio = time.perf_counter()
+        for _ in range(REPETICOES):
+            funcao()
+        resultados[nome] = (time.perf_counter() - inicio) / REPETICOES * 1000
+    return resultados
+
+
+if __name__ == '__main__':
+    logging.getLogger(app.__name__).setLevel(logging.WARNING)
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        criar_banco_antigo(os.path.join(tmp, 'indices.db'))
+
+        print('=' * 70)
+        print(f'BENCHMARK DE ÍNDICES - {N_LINHAS:,} linhas em messages e evento_historico')
+        print('=' * 70)
+
+        inicio = time.perf_counter()
+        popular(N_LINHAS)
+        print(f'Banco populado em {time.perf_counter() - inicio:.1f}s')
+
+        funcoes = consultas(N_LINHAS)
+        antes = medir(funcoes)
+
+        inicio = time.perf_counter()
+        versao = app.aplicar_migracoes(app.db.conexao())
+        app.db.conexao().execute('ANALYZE')
+        print(f'Migrações aplicadas no lugar até a versão {versao} em {time.perf_counter() - inicio:.1f}s')
+        depois = medir(funcoes)
+
+        print('-' * 70)
+        print(f'{"Consulta":<26}{"sem índices":>14}{"migrado":>14}{"ganho":>10}')
+        for nome in funcoes:
+            print(f'{nome:<26}{antes[nome]:>11.2f} ms{depois[nome]:>11.3f} ms{antes[nome] / depois[nome]:>9.0f}x')
+
+        app.db.fechar()
+        app.gravador_logs.parar()
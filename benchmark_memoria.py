@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memória: eventos crus da API x registros EventoHinova
+
+Gera N eventos no formato real de listar/evento (estrutura_api_real.json)
+divididos em respostas de um dia, como as fatias da busca, e mede com
+tracemalloc a memória retida pela lista de eventos do ciclo e o pico
+durante a leitura nos dois modelos: guardar os dicts do json.loads ou
+convertê-los em EventoHinova resposta a resposta.
+
+Uso: python benchmark_memoria.py [quantidade_eventos]
+"""
+
+import copy
+import gc
+import json
+import logging
+import os
+import sys
+import tracemalloc
+
+import app
+
+N_EVENTOS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+FATIAS = 7
+
+
+def gerar_respostas(n):
+    """Corpos JSON (bytes) das respostas, um por fatia de um dia"""
+    caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'estrutura_api_real.json')
+    with open(caminho, encoding='utf-8') as f:
+        modelo = json.load(f)['evento_exemplo']
+
+    por_fatia = -(-n // FATIAS)
+    respostas = []
+    for inicio in range(0, n, por_fatia):
+        eventos = []
+        for i in range(inicio, min(inicio + por_fatia, n)):
+            evento = copy.deepcopy(modelo)
+            evento['codigo'] = i + 1
+            evento['protocolo'] = f'2026{i:06d}'
+            evento['associado']['codigo'] = i
+            evento['associado']['nome'] = f'ASSOCIADO {i}'
+            evento['associado']['cpf'] = f'{i:011d}'
+            evento['associado']['telefone_celular'] = f'(48)9{i % 10000:04d}-{i % 9999:04d}'
+            evento['veiculo']['codigo'] = str(20000 + i)
+            evento['veiculo']['placa'] = f'ABC{i % 10000:04d}'
+            eventos.append(evento)
+        respostas.append(json.dumps(eventos).encode())
+    return respostas
+
+
+def medir(nome, ler):
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    eventos = ler()
+    gc.collect()
+    atual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    retido = atual - base
+    print(f'{nome:<22} retido {retido / 2**20:8.1f} MB ({retido / len(eventos):6.0f} B/evento)'
+          f'   pico {(pico - base) / 2**20:8.1f} MB')
+    return retido, eventos
+
+
+if __name__ == '__main__':
+    logging.getLogger(app.__name__).setLevel(logging.WARNING)
+    respostas = gerar_respostas(N_EVENTOS)
+
+    def dicts_crus():
+        eventos = []
+        for corpo in respostas:
+            eventos.extend(json.loads(corpo))
+        return eventos
+
+    def registros():
+        eventos = []
+        for corpo in respostas:
+            eventos.extend(app.EventoHinova.da_api(evento) for evento in json.loads(corpo))
+        return eventos
+
+    print('=' * 78)
+    print(f'BENCHMARK MEMÓRIA - {N_EVENTOS} eventos em {len(respostas)} respostas '
+          f'({sum(map(len, respostas)) / 2**20:.1f} MB de JSON)')
+    print('=' * 78)
+
+    retido_crus, _ = medir('Dicts crus da API', dicts_crus)
+    retido_registros, amostra = medir('EventoHinova', registros)
+
+    print('-' * 78)
+    print(f'Redução da memória retida: {retido_crus / retido_registros:.1f}x')
+    print(f'Exemplo: {amostra[0]!r}')
+    app.gravador_logs.parar()
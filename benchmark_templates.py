@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark da montagem de mensagens: template cru x template compilado
+
+Renderiza N mensagens a partir de eventos no formato da API (metade das
+situações com template configurado, metade caindo no template padrão) e
+compara o modelo antigo (template.format por evento, template padrão
+montado com f-string e strptime por evento) com os templates compilados
+na carga da configuração.
+
+Uso: python benchmark_templates.py [quantidade_mensagens]
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import app
+
+N_MENSAGENS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+
+
+def formatar_antigo(template, evento, veiculo_data):
+    """Modelo antigo: cópia da formatação feita antes dos templates compilados"""
+    associado_evento = evento.get('associado', {})
+    associado_veiculo = veiculo_data.get('associado', {}) if isinstance(veiculo_data, dict) else {}
+
+    nome = associado_evento.get('nome') or associado_veiculo.get('nome') or 'Cliente'
+    placa = (veiculo_data.get('placa') if isinstance(veiculo_data, dict) else None) or evento.get('veiculo', {}).get('placa', 'N/A')
+
+    situacao_str = evento.get('situacao_evento', 'N/A')
+    if ' - ' in str(situacao_str):
+        situacao_nome = str(situacao_str).split(' - ', 1)[1]
+    else:
+        situacao_nome = str(situacao_str)
+
+    motivo = evento.get('motivo', 'N/A')
+    if isinstance(motivo, dict):
+        motivo = motivo.get('nome', 'N/A')
+
+    data_evento = evento.get('data_evento', datetime.now().strftime('%d/%m/%Y'))
+    if data_evento and '-' in str(data_evento) and len(str(data_evento)) == 10:
+        try:
+            data_evento = datetime.strptime(str(data_evento), '%Y-%m-%d').strftime('%d/%m/%Y')
+        except ValueError:
+            pass
+
+    return template.format(nome_associado=nome, protocolo=evento.get('protocolo', 'N/A'), placa=placa,
+                           situacao=situacao_nome, motivo=motivo, data_evento=data_evento)
+
+
+def gerar_eventos(n, codigos):
+    hoje = datetime.now()
+    eventos = []
+    for i in range(n):
+        codigo = codigos[i % len(codigos)]
+        eventos.append(({
+            'protocolo': f'{100000 + i}',
+            'situacao_evento': f'{i % 10}.{i % 7} - SITUAÇÃO {codigo}',
+            'motivo': 'COLISÃO',
+            'data_evento': (hoje - timedelta(days=i % 7)).strftime('%Y-%m-%d'),
+            'associado': {'nome': f'ASSOCIADO {i}'},
+            'veiculo': {'placa': f'ABC{i % 10000:04d}', 'codigo': i}
+        }, codigo))
+    return eventos
+
+
+def medir(nome, funcao, eventos):
+    inicio = time.perf_counter()
+    for evento, codigo in eventos:
+        funcao(evento, codigo)
+    total = time.perf_counter() - inicio
+    print(f'{nome:<28} total {total * 1000:8.1f} ms   por mensagem {total / len(eventos) * 1e6:7.2f} µs')
+    return total
+
+
+if __name__ == '__main__':
+    logging.getLogger(app.__name__).setLevel(logging.WARNING)
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json'), encoding='utf-8') as f:
+        templates_crus = json.load(f)['templates_mensagem']
+    compilados, erros = app.compilar_templates(templates_crus)
+
+    # Metade dos eventos em situações sem template (cai no padrão)
+    codigos = list(templates_crus) + [f'9{i:02d}' for i in range(len(templates_crus))]
+    eventos = gerar_eventos(N_MENSAGENS, codigos)
+    # O pipeline atual recebe os eventos já compactados na leitura da API
+    registros = [(app.EventoHinova.da_api(evento), codigo) for evento, codigo in eventos]
+
+    def antigo(evento, codigo):
+        template = templates_crus.get(codigo)
+        if not template:
+            situacao_nome = evento['situacao_evento'].split(' - ', 1)[1]
+            template = f"Olá {{nome_associado}}!\n\n*{situacao_nome}*\n\nProtocolo: {{protocolo}}\nVeículo: {{placa}}\nData: {{data_evento}}"
+        return formatar_antigo(template, evento, evento['veiculo'])
+
+    def compilado(evento, codigo):
+        situacao_nome = evento.situacao_evento.split(' - ', 1)[1]
+        template = compilados.get(codigo) or app.template_padrao(situacao_nome)
+        return app.formatar_mensagem(template, evento)
+
+    # Mesma saída nos dois modelos
+    for (evento, codigo), (registro, _) in zip(eventos[:200], registros):
+        assert antigo(evento, codigo) == compilado(registro, codigo)
+
+    print('=' * 74)
+    print(f'BENCHMARK TEMPLATES - {N_MENSAGENS} mensagens, {len(compilados)} templates compilados'
+          f'{f", {len(erros)} inválidos" if erros else ""}')
+    print('=' * 74)
+
+    inicio = time.perf_counter()
+    app.compilar_templates(templates_crus)
+    print(f'Compilação dos templates: {(time.perf_counter() - inicio) * 1000:.2f} ms')
+
+    t_antigo = medir('template.format por evento', antigo, eventos)
+    t_novo = medir('Templates compilados', compilado, registros)
+
+    print('-' * 74)
+    print(f'Ganho: {t_antigo / t_novo:.1f}x')
+    app.gravador_logs.parar()
@@ -0,0 +1,14 @@
+"""Configuração do gunicorn (Dockerfile: gunicorn --config gunicorn.conf.py app:app)"""
+
+bind = '0.0.0.0:10000'
+timeout = 120
+worker_class = 'gthread'
+threads = 8
+# O agendador roda dentro do worker: mais de um worker duplicaria os ciclos
+workers = 1
+
+
+def post_worker_init(worker):
+    """Sobe banco, agendador e backups no worker (o __main__ não roda no gunicorn)"""
+    from app import iniciar_sistema
+    iniciar_sistema()